@@ -172,6 +172,7 @@ class SMD_PT_Scene(bpy.types.Panel):
 		row.alignment = 'CENTER'
 		row.prop(scene,"smd_layer_filter",text="Visible layer(s) only")
 		row.prop(scene,"smd_use_image_names",text="Ignore Blender materials")
+		row.prop(scene,"smd_export_background")
 
 		row = l.row()
 		row.alert = len(scene.smd_path) == 0
@@ -389,6 +390,7 @@ class SMD_PT_Scene_QC_Complie(bpy.types.Panel):
 		compile_row = l.row()
 		compile_row.prop(scene,"smd_qc_compile")
 		compile_row.operator(SMD_OT_Compile.bl_idname,text="Compile all now",icon='SCRIPT')
+		l.prop(scene,"smd_qc_jobs")
 		
 		if not have_qcs:
 			if scene.smd_qc_path:
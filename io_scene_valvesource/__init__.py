@@ -236,6 +236,7 @@ def register():
 	bpy.types.Scene.smd_qc_compile = BoolProperty(name="Compile all on export",description="Compile all QC files whenever anything is exported",default=False)
 	bpy.types.Scene.smd_qc_path = StringProperty(name="QC Path",description="This scene's QC file(s); Unix wildcards supported",default="//*.qc",subtype="FILE_PATH")
 	bpy.types.Scene.smd_studiomdl_custom_path = StringProperty(name="Source SDK Path",description="Directory containing studiomdl", subtype="DIR_PATH",update=studiomdl_path_changed)
+	bpy.types.Scene.smd_qc_jobs = IntProperty(name="Parallel compiles",description="How many QCs to compile at once. 0 runs one per CPU core",default=0,min=0)
 	
 	encodings = []
 	for enc in datamodel.list_support()['binary']: encodings.append( (str(enc), 'Binary ' + str(enc), '' ) )
@@ -249,6 +250,7 @@ def register():
 	bpy.types.Scene.smd_up_axis = EnumProperty(name="SMD Target Up Axis",items=axes,default='Z',description="Use for compatibility with data from other 3D tools")
 	bpy.types.Scene.smd_use_image_names = BoolProperty(name="SMD Ignore Materials",description="Only export face-assigned image filenames",default=False)
 	bpy.types.Scene.smd_layer_filter = BoolProperty(name="SMD Export visible layers only",description="Ignore objects in hidden layers",default=False)
+	bpy.types.Scene.smd_export_background = BoolProperty(name="Write in background",description="Write files and compile QCs without blocking Blender. Objects are still baked up front",default=False)
 	bpy.types.Scene.smd_material_path = StringProperty(name="DMX material path",description="Folder relative to game root containing VMTs referenced in this scene (DMX only)")
 	bpy.types.Scene.smd_export_list_active = IntProperty(name="SMD active object",default=0,update=export_active_changed)
 	bpy.types.Scene.smd_export_list = CollectionProperty(type=SMD_CT_ObjectExportProps,options={'SKIP_SAVE','HIDDEN'})	
@@ -301,12 +303,14 @@ def unregister():
 	del Scene.smd_qc_compile
 	del Scene.smd_qc_path
 	del Scene.smd_studiomdl_custom_path
+	del Scene.smd_qc_jobs
 	del Scene.smd_dmx_encoding
 	del Scene.smd_dmx_format
 	del Scene.smd_up_axis
 	del Scene.smd_format
 	del Scene.smd_use_image_names
 	del Scene.smd_layer_filter
+	del Scene.smd_export_background
 	del Scene.smd_material_path
 	del Scene.smd_use_kv2
 
@@ -0,0 +1,49 @@
+#  Copyright (c) 2013 Tom Edwards contact@steamreview.org
+#
+# ##### BEGIN GPL LICENSE BLOCK #####
+#
+#  This program is free software; you can redistribute it and/or
+#  modify it under the terms of the GNU General Public License
+#  as published by the Free Software Foundation; either version 2
+#  of the License, or (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software Foundation,
+#  Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301, USA.
+#
+# ##### END GPL LICENSE BLOCK #####
+
+# Runs studiomdl. There is no Blender dependency here, so any executable which accepts studiomdl's arguments can stand in for it.
+
+import subprocess, multiprocessing, locale
+from concurrent import futures
+
+def getJobCount(max_jobs=0):
+	return max_jobs if max_jobs > 0 else multiprocessing.cpu_count()
+
+def compileQC(executable, game_path, qc):
+	'''Compiles one QC. Returns studiomdl's exit code and console output.'''
+	process = subprocess.Popen([executable, "-nop4", "-game", game_path, qc], stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+	output = process.communicate()[0]
+	return process.returncode, output.decode(locale.getpreferredencoding(False),'replace')
+
+def compileQCs(executable, game_path, qc_paths, max_jobs=0, on_finish=None):
+	'''Compiles each QC, running up to max_jobs processes at once (0 means one per CPU core). As each compile ends, on_finish(qc, returncode, output)
+	is called on the calling thread; returncode is None if studiomdl could not be started. Returns a dict of QC paths to return codes.'''
+	results = {}
+	with futures.ThreadPoolExecutor(getJobCount(max_jobs)) as pool:
+		pending = { pool.submit(compileQC, executable, game_path, qc):qc for qc in qc_paths }
+		for future in futures.as_completed(pending):
+			qc = pending[future]
+			try:
+				returncode, output = future.result()
+			except OSError as err:
+				returncode, output = None, str(err)
+			results[qc] = returncode
+			if on_finish: on_finish(qc, returncode, output)
+	return results
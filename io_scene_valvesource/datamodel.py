@@ -23,6 +23,11 @@
 import struct, array, io, binascii, collections
 from struct import unpack,calcsize
 
+try:
+	import numpy
+except ImportError:
+	numpy = None
+
 header_format = "<!-- dmx encoding {:s} {:d} format {:s} {:d} -->"
 header_format_regex = header_format.replace("{:d}","([0-9]+)").replace("{:s}","(\S+)")
 
@@ -33,6 +38,11 @@ intsize = calcsize("i")
 shortsize = calcsize("H")
 floatsize = calcsize("f")
 
+_byte_struct = struct.Struct("B")
+_short_struct = struct.Struct("H")
+_int_struct = struct.Struct("i")
+_float_struct = struct.Struct("f")
+
 def list_support():
 	return { 'binary':[1,2,3,4,5], 'keyvalues2':[1],'binary_proto':[2] }
 
@@ -46,15 +56,11 @@ def check_support(encoding,encoding_ver):
 def _encode_binary_string(string):
 	return bytes(string,'ASCII') + bytes(1)
 
-_kv2_indent = 0
-def _get_kv2_indent():
-	return '\t' * _kv2_indent
-
 def _validate_array_list(l,array_type):
 	if not l: return
 	try:
 		for i in range(len(l)):
-			if type(l[i]) != array_type:
+			if type(l[i]) != array_type and not (l[i] is None and array_type == Element): # element arrays can hold null references
 				l[i] = array_type(l[i])
 	except:
 		raise TypeError("Could not convert all values to {}".format(array_type))
@@ -65,29 +71,70 @@ def _quote(str):
 def get_bool(file):
 	return file.read(1) != b'\x00'
 def get_byte(file):
-	return int(unpack("B",file.read(1))[0])
+	return _byte_struct.unpack(file.read(1))[0]
 def get_char(file):
 	c = file.read(1)
 	if type(c) == str: return c
 	return unpack("c",c)[0].decode('ASCII')
 def get_int(file):
-	return int( unpack("i",file.read(intsize))[0] )
+	return _int_struct.unpack(file.read(intsize))[0]
 def get_short(file):
-	return int( unpack("H",file.read(shortsize))[0] )
+	return _short_struct.unpack(file.read(shortsize))[0]
 def get_float(file):
-	return float( unpack("f",file.read(floatsize))[0] )
+	return _float_struct.unpack(file.read(floatsize))[0]
 def get_vec(file,dim):
-	return list( unpack("{}f".format(dim),file.read(floatsize*dim)) )
+	codec = _value_codecs[_vector_types_by_dim[dim]]
+	return list( codec.struct.unpack(file.read(codec.size)) )
 def get_color(file):
-	return Color(list(unpack("4B",file.read(4))))
+	return _value_codecs[Color].read(file)
 	
 def get_str(file):
+	if type(file) == _ByteCursor:
+		return file.read_str()
 	out = ""
 	while True:
 		cur = file.read(1)
 		if cur == b'\x00': return out
 		out += cur.decode('ASCII')
 
+class _ByteCursor:
+	'''Reads from a bytes or mmap buffer like a file. Used by the binary loader so that strings can be found with one scan
+	for their terminator, rather than one read per character.'''
+	__slots__ = ("data","pos")
+	def __init__(self,data,pos=0):
+		self.data = data
+		self.pos = pos
+	
+	def read(self,size=-1):
+		start = self.pos
+		self.pos = len(self.data) if size < 0 else min(start + size,len(self.data))
+		return self.data[start:self.pos]
+	def read_str(self):
+		end = self.data.find(b'\x00',self.pos)
+		if end == -1: raise EOFError("Unterminated string at offset {}".format(self.pos))
+		out = self.data[self.pos:end].decode('ASCII')
+		self.pos = end + 1
+		return out
+	
+	def seek(self,offset,whence=0):
+		if whence == 1: offset += self.pos
+		elif whence == 2: offset += len(self.data)
+		self.pos = offset
+		return offset
+	def tell(self):
+		return self.pos
+
+def _open_cursor(in_file):
+	'''Returns a _ByteCursor over the whole of a binary file, positioned where the file is. Files on disk are memory-mapped.'''
+	import mmap
+	pos = in_file.tell()
+	try:
+		data = mmap.mmap(in_file.fileno(),0,access=mmap.ACCESS_READ)
+	except (AttributeError,io.UnsupportedOperation): # not a file on disk
+		in_file.seek(0)
+		data = in_file.read()
+	return _ByteCursor(data,pos)
+
 def _get_kv2_repr(var):
 	t = type(var)
 	if t == bool:
@@ -97,7 +144,7 @@ def _get_kv2_repr(var):
 		return out.rstrip("0").rstrip(".") # two-step to protect 10.0000 etc.
 	elif t == Element:
 		return str(var.id)
-	elif issubclass(t, _Array):
+	elif issubclass(t, _Array) or t == _PackedArray:
 		return var.to_kv2()
 	elif t == Binary:
 		return binascii.hexlify(var).decode('ASCII')
@@ -118,39 +165,32 @@ class _Array(list):
 			return super().__init__()
 		
 	def to_kv2(self):
-		if len(self) == 0:
-			return "[ ]"
-		if self.type == Element:
-			out = "\n{}[\n".format(_get_kv2_indent())
-			global _kv2_indent
-			_kv2_indent += 1
-		else:
-			out = "[ "
-		
-		for i,item in enumerate(self):
-			if i > 0: out += ", "
-			if self.type == Element:				
-				if i > 0: out += "\n"
-				if item._users == 1:
-					out += _get_kv2_indent() + item.get_kv2()
-				else:
-					out += "{}{} {}".format(_get_kv2_indent(),_quote("element"),_quote(item.id))				
-			else:
-				out += _quote(_get_kv2_repr(item))
-		
-		if self.type == Element:
-			_kv2_indent -= 1
-			return "{}\n{}]".format(out,_get_kv2_indent())
-		else:
-			return "{} ]".format(out)
+		out = io.StringIO()
+		_KV2Writer(out).write_array(self)
+		return out.getvalue()
 		
 	def frombytes(self,file):
-		length = get_int(file)		
-		self.extend( unpack( typestr*length, file.read( calcsize(typestr) * length) ) )
+		'''Reads a length-prefixed run of fixed-width items with one read and one unpack. type_str describes a single item.'''
+		length = get_int(file)
+		values = list( unpack( "{}{}".format(length * len(self.type_str),self.type_str[0]), file.read( calcsize(self.type_str) * length) ) )
+		self.extend( self._from_values(values) )
+
+	@classmethod
+	def _from_values(cls,values):
+		return values
+	@classmethod
+	def _to_values(cls,items):
+		return list(items)
 
 class _BoolArray(_Array):
 	type = bool
 	type_str = "b"
+	@classmethod
+	def _from_values(cls,values):
+		return [value != 0 for value in values]
+	@classmethod
+	def _to_values(cls,items):
+		return [1 if item else 0 for item in items]
 class _IntArray(_Array):
 	type = int
 	type_str = "i"
@@ -177,9 +217,7 @@ class _Vector(list):
 		return out
 	
 	def tobytes(self):
-		out = bytes()
-		for ord in self: out += struct.pack("f",ord)
-		return out
+		return _value_codecs[type(self)].pack(self)
 		
 class Vector2(_Vector):
 	type_str = "ff"
@@ -197,12 +235,22 @@ class _VectorArray(_Array):
 	def __init__(self,list=None):
 		_validate_array_list(self,list)
 		_Array.__init__(self,list)
+	@classmethod
+	def _from_values(cls,values):
+		dim = len(cls.type_str)
+		return [cls.type(values[i:i+dim]) for i in range(0,len(values),dim)]
+	@classmethod
+	def _to_values(cls,items):
+		return [ord for item in items for ord in item]
 class _Vector2Array(_VectorArray):
 	type = Vector2
+	type_str = Vector2.type_str
 class _Vector3Array(_VectorArray):
 	type = Vector3
+	type_str = Vector3.type_str
 class _Vector4Array(_VectorArray):
 	type = Vector4
+	type_str = Vector4.type_str
 class _QuaternionArray(_Vector4Array):
 	type = Quaternion
 class _AngleArray(_Vector3Array):
@@ -220,32 +268,33 @@ class Matrix(list):
 					if type(item) != float: raise attr_error
 			
 		super().__init__(matrix)
-	def tobytes(self,datamodel,elem):
-		out = bytes()
-		for row in self: # or is it column first? Doesn't matter here, so whatever.
-			for item in row:
-				out += item.tobytes()
-		return out
+	def tobytes(self):
+		return _value_codecs[Matrix].pack(self)
 	
-class _MatrixArray():
+class _MatrixArray(_Array):
 	type = Matrix
+	type_str = "f" * 16
+	@classmethod
+	def _from_values(cls,values):
+		return [Matrix([values[i+row*4:i+row*4+4] for row in range(4)]) for i in range(0,len(values),16)]
+	@classmethod
+	def _to_values(cls,items):
+		return [ord for item in items for row in item for ord in row]
 
 class Binary(bytes):
 	pass
 class _BinaryArray(_Array):
 	type = Binary
-	type_str = "b"
 
 class Color(Vector4):
 	type = int
 	type_str = "iiii"
-	def tobytes(self):
-		out = bytes()
-		for i in self:
-			out += bytes(int(self[i]))
-		return out
 class _ColorArray(_Vector4Array):
-	pass
+	type = Color
+	type_str = "BBBB"
+	@classmethod
+	def _to_values(cls,items):
+		return [int(ord) for item in items for ord in item]
 	
 class Time(float):
 	@classmethod
@@ -253,15 +302,95 @@ class Time(float):
 		return Time(int_value / 10000)
 		
 	def tobytes(self):
-		return struct.pack("i",int(self * 10000))
+		return _value_codecs[Time].pack(self)
 
 class _TimeArray(_Array):
 	type = Time
+	type_str = "i"
+	@classmethod
+	def _from_values(cls,values):
+		return [Time.from_int(value) for value in values]
+	@classmethod
+	def _to_values(cls,items):
+		return [int(item * 10000) for item in items]
 		
-def make_array(list,t):
+class _PackedArray:
+	'''A fixed-width array stored as one contiguous buffer in its binary DMX layout, rather than as a list of Python objects.
+	Backed by numpy.ndarray if NumPy is available, otherwise by array.array. Items are converted to and from their datamodel types on access.'''
+	def __init__(self,array_type,l=None):
+		if not array_type.type_str:
+			raise TypeError("{} cannot be packed".format(array_type))
+		self.array_type = array_type
+		self.type = array_type.type
+		self.type_str = array_type.type_str
+		self.data = self._make_buffer(array_type._to_values(l) if l else [])
+		
+	def _make_buffer(self,values):
+		if numpy:
+			return numpy.array(values,dtype=self.type_str[0])
+		return array.array(self.type_str[0],values)
+	
+	def __len__(self):
+		return len(self.data) // len(self.type_str)
+	
+	def __iter__(self):
+		return iter(self.array_type._from_values(self.data.tolist()))
+	
+	def __getitem__(self,index):
+		dim = len(self.type_str)
+		if type(index) == slice: # in whole items, not scalars
+			start,stop,step = index.indices(len(self))
+			if step == 1:
+				return self.array_type._from_values(self.data[start * dim:max(start,stop) * dim].tolist())
+			return [self[i] for i in range(start,stop,step)]
+		if index < 0: index += len(self)
+		if not 0 <= index < len(self): raise IndexError("array index out of range")
+		return self.array_type._from_values(self.data[index * dim:(index + 1) * dim].tolist())[0]
+	
+	def __setitem__(self,index,item):
+		dim = len(self.type_str)
+		if index < 0: index += len(self)
+		if not 0 <= index < len(self): raise IndexError("array assignment index out of range")
+		if numpy and not self.data.flags.writeable: self.data = self.data.copy()
+		self.data[index * dim:(index + 1) * dim] = self._make_buffer(self.array_type._to_values([item]))
+	
+	def append(self,item):
+		self.extend([item])
+	
+	def extend(self,items):
+		values = self.array_type._to_values(items)
+		if numpy:
+			self.data = numpy.concatenate((self.data,self._make_buffer(values)))
+		else:
+			self.data.extend(values)
+	
+	def __repr__(self):
+		return repr(list(self))
+	
+	to_kv2 = _Array.to_kv2
+	
+	def tobytes(self):
+		return self.data.tobytes()
+	
+	def frombytes(self,file):
+		length = get_int(file)
+		raw = file.read(calcsize(self.type_str) * length)
+		if numpy: # zero-copy; made writeable on first __setitem__
+			loaded = numpy.frombuffer(raw,dtype=self.type_str[0])
+			self.data = numpy.concatenate((self.data,loaded)) if len(self.data) else loaded
+		else:
+			self.data.frombytes(raw)
+	
+def make_array(list,t,packed=False):
+	'''Creates a datamodel array of type t. If packed is True, fixed-width values are stored in a compact buffer.'''
 	if t not in _dmxtypes_all:
 		raise TypeError("{} is not a valid datamodel attribute type".format(t))
+	if packed:
+		return _PackedArray(_get_array_type(t),list)
 	return _get_array_type(t)(list)
+
+def _get_attr_type(value):
+	return value.array_type if type(value) == _PackedArray else type(value)
 		
 class AttributeError(KeyError):
 	'''Raised when an attribute is not found on an element. Essentially a KeyError, but subclassed because it's normally an unrecoverable data issue.'''
@@ -270,6 +399,14 @@ class AttributeError(KeyError):
 class IDCollisionError(Exception):
 	pass
 
+class _LazyAttribute:
+	'''Placeholder for an attribute of a lazily-loaded binary DMX. Replaced with the real value on first access.'''
+	__slots__ = ("type","offset","read")
+	def __init__(self,type,offset,read):
+		self.type = type
+		self.offset = offset
+		self.read = read
+
 _array_types = [list,set,tuple,array.array]
 class Element(collections.OrderedDict):
 	'''Effectively a dictionary, but keys must be str. Also contains a name (str), type (str) and ID (uuid.UUID, can be generated from str).'''
@@ -318,32 +455,56 @@ class Element(collections.OrderedDict):
 	def __getitem__(self,item):
 		if type(item) != str: raise TypeError("Attribute name must be a string, not {}".format(type(item)))
 		try:
-			return super().__getitem__(item)
+			value = super().__getitem__(item)
 		except KeyError:
 			raise AttributeError("No attribute \"{}\" on {}".format(item,self))
+		if type(value) == _LazyAttribute:
+			value = value.read(value)
+			super().__setitem__(item,value)
+		return value
+	
+	def get(self,item,default=None):
+		return self[item] if item in self else default
+	def values(self):
+		return [self[name] for name in self]
+	def items(self):
+		return [(name,self[name]) for name in self]
 			
 	def __setitem__(self,key,item):
 		if type(key) != str: raise TypeError("Attribute name must be string, not {}".format(type(key)))
 		
 		def import_element(elem):
-			for dm in self._datamodels:
-				if dm in elem._datamodels: continue
-				for dm_e in dm.elements:
-					if dm_e.id == elem.id:
+			# adds elem and everything below it to this element's DataModels
+			to_import = [elem]
+			visited = set()
+			while to_import:
+				elem = to_import.pop()
+				if elem is None or elem.id in visited: continue
+				visited.add(elem.id)
+				
+				imported = False
+				for dm in self._datamodels:
+					if dm in elem._datamodels: continue
+					dm_e = dm._elements_by_id.get(elem.id)
+					if dm_e is not None:
 						raise IDCollisionError("Could not add {} to {}: element ID collision with {}.".format(elem, dm, dm_e))
-				dm.elements.append(elem)
-				elem._datamodels.add(dm)
-				for attr in elem.values():
-					t = type(attr)
-					if t == Element:
-						import_element(attr)
-					if t == _ElementArray:
-						for arr_elem in attr:
-							import_element(arr_elem)
+					dm._add_element(elem)
+					elem._datamodels.add(dm)
+					imported = True
+				
+				if imported:
+					children = []
+					for attr in elem.values():
+						t = type(attr)
+						if t == Element:
+							children.append(attr)
+						elif t == _ElementArray:
+							children.extend(attr)
+					to_import.extend(reversed(children)) # preserve depth-first order
 		
 		t = type(item)
 		
-		if t in _dmxtypes_all or t == type(None):
+		if t in _dmxtypes_all or t == type(None) or t == _PackedArray:
 			if t == Element:
 					import_element(item)
 			elif t == _ElementArray:
@@ -358,61 +519,75 @@ class Element(collections.OrderedDict):
 				raise ValueError("Invalid attribute type ({})".format(t))
 		
 	def get_kv2(self,deep = True):
-		out = ""
-		out += _quote(self.type)
-		out += "\n" + _get_kv2_indent() + "{\n"
-		global _kv2_indent
-		_kv2_indent += 1
-		
-		def _make_attr_str(attr, is_array = False):
-			attr_str = _get_kv2_indent()
-			
-			for i,item in enumerate(attr):
-				if i > 0: attr_str += " "
-				
-				if is_array and i == 2:
-					attr_str += str(item)
-				else:
-					attr_str += _quote(item)
-			
-			return attr_str + "\n"
+		out = io.StringIO()
+		_KV2Writer(out).write_element(self,deep)
+		return out.getvalue()
+
+class _ElementArray(_Array):
+	type = Element
+
+class _KV2Writer:
+	'''Writes elements and arrays as KeyValues2 text straight to a file-like object, tracking its own indentation.'''
+	def __init__(self,out):
+		self.out = out
+		self.indent = 0
+	
+	def _get_indent(self):
+		return '\t' * self.indent
+	
+	def _write_attr(self,name,type_str,value_str):
+		self.out.write("{}{} {} {}\n".format(self._get_indent(),_quote(name),_quote(type_str),value_str))
+	
+	def write_element(self,elem,deep = True):
+		write = self.out.write
+		write(_quote(elem.type) + "\n" + self._get_indent() + "{\n")
+		self.indent += 1
 		
-		out += _make_attr_str([ "id", "elementid", self.id ])
-		out += _make_attr_str([ "name", "string", self.name ])
+		self._write_attr("id","elementid",_quote(elem.id))
+		self._write_attr("name","string",_quote(elem.name))
 		
-		for name in self:
-			attr = self[name]
+		for name in elem:
+			attr = elem[name]
 			if attr == None:
-				out += _make_attr_str([ name, "element", "" ])
+				self._write_attr(name,"element",_quote(""))
 				continue
 			
-			t = type(attr)
+			t = _get_attr_type(attr)
 			
 			if t == Element and attr._users < 2 and deep:
-				out += _get_kv2_indent()
-				out += _quote(name)
-				out += " {}".format( attr.get_kv2() )
-				out += "\n"
-			else:				
-				if issubclass(t,_Array):
-					if t == _ElementArray:
-						type_str = "element_array"
-					else:
-						type_str = _dmxtypes_str[_dmxtypes_array.index(t)] + "_array"
+				write(self._get_indent() + _quote(name) + " ")
+				self.write_element(attr)
+				write("\n")
+			elif issubclass(t,_Array):
+				write("{}{} {} ".format(self._get_indent(),_quote(name),_quote(_get_type_str(t))))
+				self.write_array(attr)
+				write("\n")
+			else:
+				self._write_attr(name,_get_type_str(t),_quote(_get_kv2_repr(attr)))
+		
+		self.indent -= 1
+		write(self._get_indent() + "}")
+	
+	def write_array(self,arr):
+		write = self.out.write
+		if len(arr) == 0:
+			write("[ ]")
+		elif arr.type == Element:
+			write("\n" + self._get_indent() + "[\n")
+			self.indent += 1
+			for i,item in enumerate(arr):
+				if i > 0: write(", \n")
+				if item is None:
+					write("{}{} {}".format(self._get_indent(),_quote("element"),_quote("")))
+				elif item._users == 1:
+					write(self._get_indent())
+					self.write_element(item)
 				else:
-					type_str = _dmxtypes_str[_dmxtypes.index(t)]
-				
-				out += _make_attr_str( [
-					name,
-					type_str,
-					_get_kv2_repr(attr)
-				], issubclass(t,_Array) )
-		_kv2_indent -= 1
-		out += _get_kv2_indent() + "}"
-		return out
-
-class _ElementArray(_Array):
-	type = Element
+					write("{}{} {}".format(self._get_indent(),_quote("element"),_quote(item.id)))
+			self.indent -= 1
+			write("\n" + self._get_indent() + "]")
+		else:
+			write("[ " + ", ".join([_quote(_get_kv2_repr(item)) for item in arr]) + " ]")
 
 _dmxtypes = [Element,int,float,bool,str,Binary,Time,Color,Vector2,Vector3,Vector4,Angle,Quaternion,Matrix]
 _dmxtypes_array = [_ElementArray,_IntArray,_FloatArray,_BoolArray,_StrArray,_BinaryArray,_TimeArray,_ColorArray,_Vector2Array,_Vector3Array,_Vector4Array,_AngleArray,_QuaternionArray,_MatrixArray]
@@ -428,8 +603,52 @@ attr_list_v2 = [
 	_ElementArray,_IntArray,_FloatArray,_BoolArray,_StrArray,_BinaryArray,_TimeArray,_ColorArray,_Vector2Array,_Vector3Array,_Vector4Array,_AngleArray,_QuaternionArray,_MatrixArray
 ]
 
+_dmxtypes_by_str = dict(zip(_dmxtypes_str,_dmxtypes))
+_attr_ids_v1 = { t:i for i,t in enumerate(attr_list_v1) }
+_attr_ids_v2 = { t:i for i,t in enumerate(attr_list_v2) }
+_attr_ids_v1[type(None)] = _attr_ids_v1[Element] # null element references
+_attr_ids_v2[type(None)] = _attr_ids_v2[Element]
+
+class _ValueCodec:
+	'''Reads and writes binary values of one fixed-width DMX type through a precompiled struct.Struct.'''
+	__slots__ = ("struct","size","decode","encode")
+	def __init__(self,format,decode,encode):
+		self.struct = struct.Struct(format)
+		self.size = self.struct.size
+		self.decode = decode
+		self.encode = encode
+	
+	def read(self,file):
+		return self.decode(self.struct.unpack(file.read(self.size)))
+	def pack(self,value):
+		return self.struct.pack(*self.encode(value))
+
+def _vector_codec(t):
+	return _ValueCodec(t.type_str, lambda values: t(list(values)), lambda value: value)
+
+# The layout of these types is the same in every binary encoding version; strings and element references are version-dependent
+# and stay with _BinaryReader and DataModel._write.
+_value_codecs = {
+	bool: _ValueCodec("b", lambda values: values[0] != 0, lambda value: (value,)),
+	int: _ValueCodec("i", lambda values: values[0], lambda value: (value,)),
+	float: _ValueCodec("f", lambda values: values[0], lambda value: (value,)),
+	Time: _ValueCodec("i", lambda values: Time.from_int(values[0]), lambda value: (int(value * 10000),)),
+	Color: _ValueCodec("4B", lambda values: Color(list(values)), lambda value: [int(i) for i in value]),
+	Vector2: _vector_codec(Vector2),
+	Vector3: _vector_codec(Vector3),
+	Vector4: _vector_codec(Vector4),
+	Angle: _vector_codec(Angle),
+	Quaternion: _vector_codec(Quaternion),
+	Matrix: _ValueCodec("16f", lambda values: Matrix([list(values[i:i+4]) for i in range(0,16,4)]), lambda value: [item for row in value for item in row]),
+}
+_vector_types_by_dim = { 2:Vector2, 3:Vector3, 4:Vector4 } # for get_vec
+
 def _get_type_from_string(type_str):
-	return _dmxtypes[_dmxtypes_str.index(type_str)]
+	return _dmxtypes_by_str[type_str]
+def _get_type_str(t):
+	if t in _dmxtypes_array:
+		return _dmxtypes_str[_dmxtypes_array.index(t)] + "_array"
+	return _dmxtypes_str[_dmxtypes.index(t)]
 def _get_array_type(single_type):
 	if single_type in _dmxtypes_array: raise ValueError("Argument is already an array type")
 	return _dmxtypes_array[ _dmxtypes.index(single_type) ]
@@ -444,28 +663,54 @@ def _get_dmx_id_type(encoding,version,id):
 		if version in [3,4,5]:
 			return attr_list_v2[id]
 	if encoding == "keyvalues2":
-		return _dmxtypes[ _dmxtypes_str.index(id) ]
+		return _dmxtypes_by_str[id]
 				
 	raise ValueError("Type ID {} invalid in {} {}".format(id,encoding,version))
 	
+def _get_dmx_id_types(encoding,version):
+	if encoding == "binary_proto" or (encoding == "binary" and version in [1,2]):
+		return attr_list_v1
+	if encoding == "binary" and version in [3,4,5]:
+		return attr_list_v2
+	raise ValueError("Type IDs do not exist in {} {}".format(encoding,version))
+	
+def _get_dmx_type_ids(encoding,version):
+	return _attr_ids_v1 if _get_dmx_id_types(encoding,version) is attr_list_v1 else _attr_ids_v2
+
 def _get_dmx_type_id(encoding,version,t):	
-	if t == type(None): t = Element
 	if encoding == "keyvalues2": raise ValueError("Type IDs do not exist in KeyValues2")
 	try:
-		if encoding == "binary":
-			if version in [1,2]:
-				return attr_list_v1.index(t)
-			if version in [3,4,5]:
-				return attr_list_v2.index(t)
-		elif encoding == "binary_proto":
-			return attr_list_v1.index(t)
-	except:
+		return _get_dmx_type_ids(encoding,version)[t]
+	except KeyError:
 		raise ValueError("Type {} not supported in {} {}".format(t,encoding,version))
 
+class _ElementIndex:
+	'''Ordered set of elements which can report the position of any member without searching.'''
+	def __init__(self):
+		self.elements = []
+		self.indices = {}
+	
+	def __len__(self):
+		return len(self.elements)
+	def __iter__(self):
+		return iter(self.elements)
+	def __contains__(self,elem):
+		return elem.id in self.indices
+	
+	def add(self,elem):
+		if elem.id not in self.indices:
+			self.indices[elem.id] = len(self.elements)
+			self.elements.append(elem)
+	
+	def index(self,elem):
+		return self.indices[elem.id]
+
 class _StringDictionary(list):
+	'''The string table of a binary DMX. When writing, strings are stored in the order they are first encountered so that output is repeatable.'''
 	dummy = False
 	
 	def __init__(self,encoding,encoding_ver,in_file=None,out_datamodel=None):
+		self.indices = {}
 		if encoding == "binary":
 			self.indice_size = self.length_size = intsize
 				
@@ -486,23 +731,25 @@ class _StringDictionary(list):
 				self.append(get_str(in_file))
 		
 		elif out_datamodel:
-			checked = []
-			string_set = set()
+			checked = set()
+			def add_string(string):
+				if string not in self.indices:
+					self.indices[string] = len(self)
+					self.append(string)
 			def process_element(elem):
-				checked.append(elem)
-				string_set.add(elem.name)
-				string_set.add(elem.type)
+				checked.add(elem.id)
+				add_string(elem.type)
+				add_string(elem.name)
 				for name in elem:
 					attr = elem[name]
-					string_set.add(name)
-					if type(attr) == str: string_set.add(attr)
+					add_string(name)
+					if type(attr) == str: add_string(attr)
 					elif type(attr) == Element:
-						if attr not in checked: process_element(attr)
+						if attr.id not in checked: process_element(attr)
 					elif type(attr) == _ElementArray:
 						for i in attr:
-							if i not in checked: process_element(i)
+							if i is not None and i.id not in checked: process_element(i)
 			process_element(out_datamodel.root)
-			self.extend(string_set)
 		
 	def read_string(self,in_file):
 		if self.dummy:
@@ -514,8 +761,7 @@ class _StringDictionary(list):
 		if self.dummy:
 			out_file.write( _encode_binary_string(string) )
 		else:
-			assert(string in self)
-			out_file.write( struct.pack("H" if self.indice_size == shortsize else "i", self.index(string) ) )
+			out_file.write( struct.pack("H" if self.indice_size == shortsize else "i", self.indices[string] ) )
 		
 	def write_dictionary(self,out_file):
 		if not self.dummy:
@@ -523,6 +769,23 @@ class _StringDictionary(list):
 			for string in self:
 				out_file.write( _encode_binary_string(string) )
 	
+class _BufferedWriter:
+	'''Collects binary output in a bytearray and passes it on to the real file in large blocks.'''
+	block_size = 1 << 20
+	
+	def __init__(self,out_file):
+		self.out_file = out_file
+		self.buffer = bytearray()
+	
+	def write(self,data):
+		self.buffer += data
+		if len(self.buffer) >= self.block_size:
+			self.flush()
+	
+	def flush(self):
+		self.out_file.write(self.buffer)
+		del self.buffer[:]
+
 class DataModel:
 	'''Container for Element objects. Has a format name (str) and format version (int). Can write itself to a string object or a file.'''
 	elements = None
@@ -536,49 +799,63 @@ class DataModel:
 		self.format_ver = format_ver
 		
 		self.elements = []
+		self._elements_by_id = {}
 		
 	def __repr__(self):
 		return "<Datamodel 0x{}{}>".format(id(self)," (root is \"{}\")".format(self.root.name) if self.root else "")
 		
 	def add_element(self,name,elemtype="DmElement",id=None,_is_placeholder=False):
 		elem = Element(self,name,elemtype,id,_is_placeholder)
-		try:
-			dupe_elem = self.elements.index(elem)
-			if not self.elements[dupe_elem]._is_placeholder: raise ValueError("ID {} already in use in this datamodel.".format(id))
-		except: pass
+		if _is_placeholder: # no need for a placeholder if the element, or a placeholder for it, already exists
+			existing = self._elements_by_id.get(elem.id)
+			if existing is not None: return existing
+		self._add_element(elem)
+		return elem
+	
+	def _add_element(self,elem):
 		self.elements.append(elem)
+		existing = self._elements_by_id.get(elem.id)
+		if existing is None or existing._is_placeholder:
+			self._elements_by_id[elem.id] = elem
 		elem.datamodel = self
 		if len(self.elements) == 1: self.root = elem
-		return elem
 		
 	def find_elements(self,name=None,id=None,elemtype=None):
-		out = []
 		import uuid
-		if type(id) == str: id = uuid.UUID(id)
-		for elem in self.elements:
-			if elem.id == id: return elem
-			if elem.name == name: out.append(elem)
-			if elem.type == elemtype: out.append(elem)
+		if id != None:
+			if type(id) == str: id = uuid.UUID(id)
+			elem = self._elements_by_id.get(id)
+			if elem is not None: return elem
+		out = []
+		if name != None or elemtype != None:
+			for elem in self.elements:
+				if elem.name == name: out.append(elem)
+				if elem.type == elemtype: out.append(elem)
 		if len(out): return out
 		
 	def _write(self,value, elem = None, suppress_dict = False):
 		import uuid
 		t = type(value)
+		codec = _value_codecs.get(t)
 		
-		if t in [bytes,Binary]:
+		if codec:
+			self.out.write(codec.pack(value))
+		elif t in [bytes,Binary]:
 			if t == Binary:
 				self.out.write( struct.pack("i",len(value)) )
 			self.out.write(value)
 		
 		elif t == uuid.UUID:
 			self.out.write(value.bytes)
+		elif value is None: # null element reference
+			self._write(-1)
 		elif t == Element:
 			if value._is_placeholder:
 				if self.encoding_ver < 5:
 					self._write(-1)
 				else:
 					self._write(-2)
-					self._write(str(value.id))
+					self._write(str(value.id),suppress_dict=True)
 			else:
 				self._write(self.elem_chain.index(value),elem)
 		elif t == str:
@@ -587,20 +864,20 @@ class DataModel:
 			else:
 				self._string_dict.write_string(self.out,value)
 				
+		elif t == _PackedArray:
+			self.out.write( struct.pack("i",len(value)) )
+			self.out.write( memoryview(value.data) )
 		elif issubclass(t, _Array):
 			self.out.write( struct.pack("i",len(value)) )
-			for item in value:
-				self._write(item,suppress_dict=True)
-		elif issubclass(t,_Vector) or t == Time:
-			self.out.write(value.tobytes())
-		
-		elif t == bool:
-			self.out.write( struct.pack("b",value) )
-		elif t == int:
-			self.out.write( struct.pack("i",value) )
-		elif t == float:
-			self.out.write( struct.pack("f",value) )
-			
+			if t.type_str: # fixed-width items are packed in one go
+				self.out.write( struct.pack( "{}{}".format(len(value) * len(t.type_str),t.type_str[0]), *t._to_values(value) ) )
+			elif t == _StrArray:
+				self.out.write( b"".join([_encode_binary_string(item) for item in value]) )
+			elif t == _ElementArray and (self.encoding_ver < 5 or not any(item is not None and item._is_placeholder for item in value)):
+				self.out.write( struct.pack( "{}i".format(len(value)), *[-1 if item is None or item._is_placeholder else self.elem_chain.index(item) for item in value] ) )
+			else:
+				for item in value:
+					self._write(item,suppress_dict=True)
 		else:
 			raise TypeError("Cannot write attributes of type {}".format(t))
 	
@@ -610,7 +887,7 @@ class DataModel:
 		self._write(elem.name, suppress_dict = self.encoding_ver < 4)
 		self._write(elem.id)
 		
-		self.elem_chain.append(elem)
+		self.elem_chain.add(elem)
 		
 		for name in elem:
 			attr = elem[name]
@@ -619,31 +896,46 @@ class DataModel:
 				self._write_element_index(attr)
 			if t == _ElementArray:
 				for i in attr:
-					if i not in self.elem_chain:
+					if i is not None and i not in self.elem_chain:
 						self._write_element_index(i)
 		
 	def _write_element_props(self):	
+		type_ids = _get_dmx_type_ids(self.encoding, self.encoding_ver)
 		for elem in self.elem_chain:
 			if elem._is_placeholder: continue
 			self._write(len(elem))
 			for name in elem:
 				attr = elem[name]
 				self._write(name)
-				self._write( struct.pack("b", _get_dmx_type_id(self.encoding, self.encoding_ver, type(attr) )) )
+				attr_type = _get_attr_type(attr)
+				if attr_type not in type_ids:
+					raise ValueError("Type {} not supported in {} {}".format(attr_type,self.encoding,self.encoding_ver))
+				self.out.write( bytes((type_ids[attr_type],)) )
 				if attr == None:
 					self._write(-1)
 				else:
 					self._write(attr,elem, suppress_dict = self.encoding_ver < 4)
 					
 	def echo(self,encoding,encoding_ver):
+		out = io.BytesIO() if encoding in ["binary", "binary_proto"] else io.StringIO()
+		self._echo(out,encoding,encoding_ver)
+		return out.getvalue()
+		
+	def write(self,path,encoding,encoding_ver):
+		'''Writes to a path, or to a file object opened in binary mode for binary encodings and text mode for KeyValues2.'''
+		if hasattr(path,'write'):
+			self._echo(path,encoding,encoding_ver)
+			return
+		with open(path,'wb' if encoding in ["binary","binary_proto"] else 'w') as file:
+			self._echo(file,encoding,encoding_ver)
+	
+	def _echo(self,out,encoding,encoding_ver):
 		check_support(encoding, encoding_ver)
 		
 		if encoding in ["binary", "binary_proto"]:
-			self.out = io.BytesIO()
+			self.out = _BufferedWriter(out)
 		else:
-			self.out = io.StringIO()
-			global _kv2_indent
-			_kv2_indent = 0
+			self.out = out
 		
 		self.encoding = encoding
 		self.encoding_ver = encoding_ver
@@ -657,16 +949,16 @@ class DataModel:
 			elif self.encoding == 'keyvalues2':
 				self.out.write(header + "\n")
 		
-		if encoding == 'binary':
+		if encoding in ['binary', 'binary_proto']: # binary_proto has no dictionary, but _StringDictionary writes strings inline for it
 			self._string_dict = _StringDictionary(encoding,encoding_ver,out_datamodel=self)
 			self._string_dict.write_dictionary(self.out)
 			
 		# count elements
-		out_elems = []
+		out_elems = _ElementIndex()
 		for elem in self.elements:
 			elem._users = 0
 		def _count_child_elems(elem):
-			out_elems.append(elem)
+			out_elems.add(elem)
 			for name in elem:
 				attr = elem[name]
 				t = type(attr)
@@ -676,68 +968,213 @@ class DataModel:
 					attr._users += 1
 				elif t == _ElementArray:
 					for i in attr:
+						if i is None: continue
 						if i not in out_elems:
 							_count_child_elems(i)
 						i._users += 1
 		_count_child_elems(self.root)
 		
 		if self.encoding in ["binary", "binary_proto"]:
-			self._write(len(out_elems))
-			self.elem_chain = []
+			self._write(len([elem for elem in out_elems if not elem._is_placeholder]))
+			self.elem_chain = _ElementIndex()
 			self._write_element_index(self.root)
 			self._write_element_props()
 		elif self.encoding == 'keyvalues2':
-			self.out.write(self.root.get_kv2() + "\n\n")
+			kv2_writer = _KV2Writer(self.out)
+			kv2_writer.write_element(self.root)
+			self.out.write("\n\n")
 			for elem in out_elems:
 				if elem._users > 1:
-					self.out.write(elem.get_kv2() + "\n\n")
-				
+					kv2_writer.write_element(elem)
+					self.out.write("\n\n")
+		
+		if type(self.out) == _BufferedWriter:
+			self.out.flush()
 		self._string_dict = None
-		return self.out.getvalue()
+		self.out = None
+
+def _read_header(in_file):
+	'''Reads the header comment at the start of a DMX file. Returns it with the encoding, encoding version, format and format version it names.'''
+	import re
+	try:
+		start = in_file.tell()
+		header = in_file.read(256) # comfortably longer than any header
+		if type(header) != str: header = header.decode('latin-1')
+		header = header[:header.index(">") + 1]
+		in_file.seek(start + len(header))
 		
-	def write(self,path,encoding,encoding_ver):
-		with open(path,'wb' if encoding in ["binary","binary_proto"] else 'w') as file:
-			file.write(self.echo(encoding,encoding_ver))
+		matches = re.findall(header_format_regex,header)
+		
+		if len(matches) != 1 or len(matches[0]) != 4:
+			matches = re.findall(header_proto2_regex,header)
+			if len(matches) == 1 and len(matches[0]) == 1:
+				encoding = "binary_proto"
+				encoding_ver = int(matches[0][0])
+				format = "undefined_format"
+				format_ver = 0
+			else:
+				raise Exception()
+		else:
+			encoding,encoding_ver, format,format_ver = matches[0]
+			encoding_ver = int(encoding_ver)
+			format_ver = int(format_ver)
+	except:
+		raise Exception("Could not read DMX header")
+	
+	check_support(encoding,encoding_ver)
+	return header,encoding,encoding_ver,format,format_ver
+
+class _BinaryReader:
+	'''Decodes the element headers and attribute values of a binary DMX file, starting at its string dictionary.
+	resolve_element(index,id) provides the value of element references: id is a UUID for elements outside the file, otherwise None.'''
+	def __init__(self,in_file,encoding,encoding_ver,resolve_element,packed=False):
+		self.in_file = in_file
+		self.encoding = encoding
+		self.encoding_ver = encoding_ver
+		self.resolve_element = resolve_element
+		self.packed = packed
+		self.id_types = _get_dmx_id_types(encoding,encoding_ver)
+		self.string_dict = _StringDictionary(encoding,encoding_ver,in_file=in_file)
+	
+	def read_element_headers(self):
+		import uuid
+		in_file = self.in_file
+		headers = []
+		for i in range(get_int(in_file)):
+			elemtype = self.string_dict.read_string(in_file)
+			name = self.string_dict.read_string(in_file) if self.encoding_ver >= 4 else get_str(in_file)
+			id = uuid.UUID(bytes_le = in_file.read(16)) # little-endian
+			headers.append((elemtype,name,id))
+		return headers
+	
+	def read_attribute_header(self):
+		name = self.string_dict.read_string(self.in_file)
+		return name, self.id_types[get_byte(self.in_file)]
+	
+	def get_value(self,attr_type,from_array = False):
+		in_file = self.in_file
+		codec = _value_codecs.get(attr_type)
+		if codec:
+			return codec.read(in_file)
+		elif attr_type == Element:
+			element_index = get_int(in_file)
+			if element_index == -1:
+				return None
+			elif element_index == -2:
+				import uuid
+				return self.resolve_element(None,uuid.UUID(hex=get_str(in_file)))
+			else:
+				return self.resolve_element(element_index,None)
+			
+		elif attr_type == str:		return get_str(in_file) if self.encoding_ver < 4 or from_array else self.string_dict.read_string(in_file)
+		elif attr_type == Binary:	return Binary(in_file.read(get_int(in_file)))
+			
+		else:
+			raise TypeError("Cannot read attributes of type {}".format(attr_type))
+	
+	def get_attribute(self,attr_type):
+		if attr_type in _dmxtypes:
+			return self.get_value(attr_type)
+		elif attr_type in _dmxtypes_array:
+			arr = _PackedArray(attr_type) if self.packed and attr_type.type_str else attr_type()
+			if arr.type_str: # fixed-width items are decoded in bulk
+				arr.frombytes(self.in_file)
+			else:
+				arr_item_type = _get_single_type(attr_type)
+				for x in range(get_int(self.in_file)):
+					arr.append( self.get_value(arr_item_type,from_array=True) )
+			return arr
+		else:
+			raise TypeError("Cannot read attributes of type {}".format(attr_type))
+	
+	def skip_value(self,attr_type,from_array = False):
+		in_file = self.in_file
+		codec = _value_codecs.get(attr_type)
+		if codec:
+			in_file.seek(codec.size,1)
+		elif attr_type == Element:
+			if get_int(in_file) == -2: get_str(in_file)
+		elif attr_type == str:
+			if self.encoding_ver < 4 or from_array: get_str(in_file)
+			else: self.string_dict.read_string(in_file)
+		elif attr_type == Binary:
+			in_file.seek(get_int(in_file),1)
+		elif attr_type in _dmxtypes_array:
+			array_len = get_int(in_file)
+			if attr_type.type_str:
+				in_file.seek(calcsize(attr_type.type_str) * array_len,1)
+			else:
+				arr_item_type = _get_single_type(attr_type)
+				for x in range(array_len):
+					self.skip_value(arr_item_type,from_array=True)
+		else:
+			raise TypeError("Cannot read attributes of type {}".format(attr_type))
+
+_parallel_min_bytes = 1 << 16 # smaller arrays are decoded on the loading thread
+
+def _decode_array(attr_type,payload,packed):
+	'''Decodes a length-prefixed fixed-width array attribute. Runs in load()'s worker pool, so must be importable by name.'''
+	arr = _PackedArray(attr_type) if packed else attr_type()
+	arr.frombytes(_ByteCursor(payload))
+	return arr
+
+ElementHeader = collections.namedtuple("ElementHeader",["index","type","name","id"])
+AttributeRecord = collections.namedtuple("AttributeRecord",["element","name","type","value"])
+
+def iter_elements(path = None, in_file = None, attributes = None, packed = False):
+	'''Reads a binary DMX without building a DataModel. First yields an ElementHeader for each element in the file, then an AttributeRecord
+	for each attribute as it is read. Element references are given as ElementHeaders, or as UUIDs if they point outside the file.
+	If attributes is a collection of names, all other attributes are skipped over and yielded with a value of None.'''
+	if bool(path) == bool(in_file):
+		raise ValueError("A path string OR a file object must be provided")
+	if not in_file:
+		in_file = open(path,'rb')
+	file_handle = in_file
+	
+	try:
+		header,encoding,encoding_ver,format,format_ver = _read_header(in_file)
+		if encoding not in ['binary', 'binary_proto']:
+			raise ValueError("iter_elements() only supports binary DMX, not {}".format(encoding))
+		in_file.seek(2,1) # skip header's line break and null terminator
+		in_file = _open_cursor(in_file)
+		
+		headers = []
+		reader = _BinaryReader(in_file,encoding,encoding_ver,lambda index,id: id if id else headers[index],packed)
+		for elemtype,name,id in reader.read_element_headers():
+			headers.append(ElementHeader(len(headers),elemtype,name,id))
+			yield headers[-1]
+		
+		for elem_header in headers:
+			for i in range(get_int(in_file)):
+				name,attr_type = reader.read_attribute_header()
+				if attributes == None or name in attributes:
+					value = reader.get_attribute(attr_type)
+				else:
+					reader.skip_value(attr_type)
+					value = None
+				yield AttributeRecord(elem_header,name,_get_type_str(attr_type),value)
+	finally:
+		if file_handle: file_handle.close()
 
 def parse(parse_string, element_path=None):
 	return load(in_file=io.StringIO(parse_string),element_path=element_path)
 
-def load(path = None, in_file = None, element_path = None):
+def load(path = None, in_file = None, element_path = None, lazy = False, packed = False, workers = 0):
+	'''Reads a DataModel from a path or file object. If lazy is True, binary attributes are only decoded when first accessed.
+	If packed is True, fixed-width binary arrays are kept in compact buffers (see make_array).
+	If workers is greater than 1, large fixed-width binary arrays are decoded in parallel: on threads if packed and NumPy is available, otherwise on processes.'''
 	if bool(path) == bool(in_file):
 		raise ValueError("A path string OR a file object must be provided")
 	if element_path != None and type(element_path) != list:
 		raise TypeError("element_path must be a list containing element names")
 	if not in_file:
 		in_file = open(path,'rb')
+	file_handle = in_file
 	
 	try:
 		import re, uuid
 		
-		try:
-			header = ""
-			while True:
-				header += get_char(in_file)
-				if header.endswith(">"): break
-			
-			matches = re.findall(header_format_regex,header)
-			
-			if len(matches) != 1 or len(matches[0]) != 4:
-				matches = re.findall(header_proto2_regex,header)
-				if len(matches) == 1 and len(matches[0]) == 1:
-					encoding = "binary_proto"
-					encoding_ver = int(matches[0][0])
-					format = "undefined_format"
-					format_ver = 0
-				else:
-					raise Exception()
-			else:
-				encoding,encoding_ver, format,format_ver = matches[0]
-				encoding_ver = int(encoding_ver)
-				format_ver = int(format_ver)
-		except:
-			raise Exception("Could not read DMX header")
-		
-		check_support(encoding,encoding_ver)
+		header,encoding,encoding_ver,format,format_ver = _read_header(in_file)
 		dm = DataModel(format,format_ver)
 		
 		max_elem_path = len(element_path) + 1 if element_path else 0
@@ -749,203 +1186,201 @@ def load(path = None, in_file = None, element_path = None):
 					self.Name = Name
 					self.Index = Index
 			
-			def parse_line(line):
-				return re.findall("\"(.*?)\"",line.strip("\n\t ") )
-				
-			def read_element(elem_type):
-				id = None
-				name = None
+			value_converters = { 'string':str, 'int':int, 'float':float, 'bool':lambda kv2_value: bool(int(kv2_value)), 'time':Time }
+			
+			def read_value(type_str,kv2_value):
+				if type_str == 'element':
+					if not kv2_value:
+						return None
+					id = uuid.UUID(hex=kv2_value)
+					elem = dm._elements_by_id.get(id)
+					if elem is None: # forward reference; linked up when the element is defined
+						elem = placeholders.get(id)
+						if elem is None:
+							elem = placeholders[id] = Element(dm,"Missing element",id=id,_is_placeholder=True)
+					return elem
 				
-				def read_value(name,type_str,kv2_value, index=-1):
-					if type_str == 'element': # make a record; will link everything up once all elements have been read
-						if not kv2_value:
-							return None
+				elif type_str in value_converters: return value_converters[type_str](kv2_value)
+				elif type_str.startswith('vector') or type_str in ['color','quaternion','angle']:
+					return _get_type_from_string(type_str)( [float(i) for i in kv2_value.split()] )
+			
+			def set_attribute(elem,name,value):
+				elem[name] = value
+				if type(value) == Element and value._is_placeholder:
+					link_reference(value.id,AttributeReference(elem,name))
+				elif type(value) == _ElementArray:
+					for i,item in enumerate(value):
+						if item is not None and item._is_placeholder:
+							link_reference(item.id,AttributeReference(elem,name,i))
+			
+			def link_reference(id,user_info):
+				target = dm._elements_by_id.get(id)
+				if target is None: # not read yet
+					element_users[id].append(user_info)
+				elif user_info.Index == -1:
+					user_info.Owner[user_info.Name] = target
+				else:
+					user_info.Owner[user_info.Name][user_info.Index] = target
+			
+			def skip_element():
+				depth = 0
+				for token in tokens:
+					if token == "{": depth += 1
+					elif token == "}":
+						if depth == 0: return
+						depth -= 1
+				raise IOError("Unexpected EOF")
+			
+			def read_array(type_str):
+				if type_str == "element_array":
+					arr = _ElementArray()
+					for token in tokens:
+						if token == "]": return arr
+						value = next(tokens)
+						if value == "{": # inline element
+							elem = read_element(token[1:-1])
+							if elem is not None: arr.append(elem) # None if skipped by element_path; an element without attributes is falsy
 						else:
-							element_users[kv2_value].append(AttributeReference(element_chain[-1], name, index))
-							return dm.add_element("Missing element",id=uuid.UUID(hex=kv2_value),_is_placeholder=True)
-					
-					elif type_str == 'string': return kv2_value
-					elif type_str == 'int': return int(kv2_value)
-					elif type_str == 'float': return float(kv2_value)
-					elif type_str == 'bool': return bool(int(kv2_value))
-					elif type_str == 'time': return Time(kv2_value)
-					elif type_str.startswith('vector') or type_str in ['color','quaternion','angle']:
-						return _get_type_from_string(type_str)( [float(i) for i in kv2_value.split(" ")] )
-				
-				new_elem = None
-				for line_raw in in_file:
-					if line_raw.strip("\n\t, ").endswith("}"):
-						#print("{}- {}".format('\t' * (len(element_chain)-1),element_chain[-1].name))
-						return element_chain.pop()
-					
-					line = parse_line(line_raw)
-					if len(line) == 0:
-						continue
-					
-					if line[0] == 'id': id = uuid.UUID(hex=line[2])
-					elif line[0] == 'name': name = line[2]
+							arr.append(read_value("element",value[1:-1]))
+				else:
+					item_type_str = type_str[:-len("_array")]
+					arr = _get_array_type(_get_type_from_string(item_type_str))()
+					items = []
+					for token in tokens:
+						if token == "]": break
+						items.append(token[1:-1])
+					else:
+						raise IOError("Unexpected EOF")
 					
-					# don't read elements outside the element path
-					if max_elem_path and name and len(dm.elements):
-						if len(element_path):
-							skip = name.lower() != element_path[0].lower()
-						else:
-							skip = len(element_chain) < max_elem_path
-						if skip:
-							child_level = 0
-							for line_raw in in_file:
-								if "{" in line_raw: child_level += 1
-								if "}" in line_raw:
-									if child_level == 0: return
-									else: child_level -= 1
-							return
-						elif len(element_path):
-							del element_path[0]
+					if item_type_str in value_converters:
+						convert = value_converters[item_type_str]
+						arr.extend([convert(item) for item in items])
+					elif issubclass(arr.type,_Vector):
+						arr.extend(arr._from_values([float(i) for item in items for i in item.split()]))
+					else:
+						arr.extend([read_value(item_type_str,item) for item in items])
+					return arr
+				raise IOError("Unexpected EOF")
+			
+			def in_element_path(name):
+				'''Whether an element with this name, about to be read at the current depth, is on the element path.'''
+				if not max_elem_path or not len(dm.elements): return True # the root is always read
+				depth = len(element_chain)
+				if 0 < depth <= len(element_path):
+					return name.lower() == element_path[depth - 1].lower()
+				return depth >= max_elem_path # below the end of the path
+			
+			def read_element(elem_type):
+				id = name = elem = None
+				pending = []
+				for token in tokens:
+					if token == "}":
+						break
+					attr_name = token[1:-1]
+					type_str = next(tokens)[1:-1]
+					value = next(tokens)
 					
-					if id and name:
-						new_elem = dm.add_element(name,elem_type,id)
-						element_chain.append(new_elem)
-						#print("{}+ {}".format('\t' * (len(element_chain)-1),element_chain[-1].name))
-						id = name = None
-						continue
+					if elem == None:
+						if attr_name == "id": id = uuid.UUID(hex=value[1:-1])
+						elif attr_name == "name":
+							name = value[1:-1]
+							if not in_element_path(name): # checked once per element, when its name is read
+								skip_element()
+								return None
+						
+						if id and name != None:
+							elem = dm.add_element(name,elem_type,id)
+							element_chain.append(elem)
+							placeholders.pop(id,None)
+							for user_info in element_users.pop(id,[]):
+								link_reference(id,user_info)
+							for pending_name,pending_value in pending:
+								set_attribute(elem,pending_name,pending_value)
+							continue
+						if attr_name in ["id","name"]:
+							continue
 					
-					if new_elem == None:
-						continue
+					if value == "{": # inline element
+						value = read_element(type_str)
+					elif value == "[":
+						value = read_array(type_str)
+					else:
+						value = read_value(type_str,value[1:-1])
 					
-					if len(line) >= 2:
-						if line[1] == "element_array":
-							arr_name = line[0]
-							arr = _ElementArray()
-							
-							if "[" not in line_raw: # immediate "[" means and empty array; elements must be on separate lines
-								for line in in_file:
-									if "[" in line: continue
-									if "]" in line: break
-									line = parse_line(line)
-									
-									if len(line) == 1:
-										arr.append( read_element(line[0]) )
-									elif len(line) == 2:
-										arr.append( read_value(arr_name,"element",line[1],index=len(arr)) )								
-							
-							element_chain[-1][arr_name] = arr
-							continue
-						
-						elif line[1].endswith("_array"):
-							arr_name = line[0]
-							arr_type_str = line[1].split("_")[0]
-							arr = _get_array_type(_get_type_from_string(arr_type_str))()
-							
-							if "[" in line_raw: # one-line array
-								for item in line[2:]:
-									arr.append(read_value(arr_name,arr_type_str,item))
-								element_chain[-1][arr_name] = arr
-								
-							else: # multi-line array
-								for line in in_file:
-									if "[" in line:
-										continue
-									if "]" in line:
-										element_chain[-1][arr_name] = arr
-										break
-										
-									line = parse_line(line)
-									arr.append(read_value(arr_name,arr_type_str,line[0]))
-						
-						elif len(line) == 2: # inline element
-							element_chain[-1][line[0]] = read_element(line[1])
-						elif len(line) == 3: # ordinary attribute or element ID
-							element_chain[-1][line[0]] = read_value(line[0],line[1],line[2])
-
-				raise IOError("Unexpected EOF")
+					if elem == None:
+						pending.append((attr_name,value))
+					else:
+						set_attribute(elem,attr_name,value)
+				else:
+					raise IOError("Unexpected EOF")
+				
+				if elem == None: raise IOError("Element of type \"{}\" has no id or name".format(elem_type))
+				return element_chain.pop()
 			
 			if ('mode' in dir(in_file) and 'b' in in_file.mode): in_file = io.TextIOWrapper(in_file)
 			in_file.seek(len(header))
 			
+			# every quoted string is a token, as are braces and brackets. Everything else is whitespace or a separator.
+			tokens = iter(re.findall(r'"[^"]*"|[{}\[\]]',in_file.read()))
+			
 			element_chain = []
 			element_users = collections.defaultdict(list)
-			for line in in_file:
-				line = parse_line(line)
-				if len(line) == 0: continue
-				
-				if len(element_chain) == 0 and len(line) == 1:
-					read_element(line[0])
+			placeholders = {}
+			for token in tokens:
+				if next(tokens) != "{": raise IOError("Expected element body after {}".format(token))
+				read_element(token[1:-1])
 			
-			for element in dm.elements:
-				if element._is_placeholder == True: continue
-				users = element_users[str(element.id)]
-				for user_info in users:
-					if user_info.Index == -1:
-						user_info.Owner[user_info.Name] = element
-					else:
-						user_info.Owner[user_info.Name][user_info.Index] = element
+			for placeholder in placeholders.values(): # elements which were referenced but never defined
+				dm._add_element(placeholder)
 				
 		elif encoding in ['binary', 'binary_proto']:
 			in_file.seek(2,1) # skip header's line break and null terminator
+			in_file = _open_cursor(in_file) # if lazy, the cursor outlives this function so that attributes can be read on demand
 			
-			dm._string_dict = _StringDictionary(encoding,encoding_ver,in_file=in_file)
+			def resolve_element(index,id):
+				if id: return dm.add_element("Missing element",id=id,_is_placeholder=True)
+				return dm.elements[index]
 			
-			num_elements = get_int(in_file)
+			reader = _BinaryReader(in_file,encoding,encoding_ver,resolve_element,packed)
 			
-			# element headers
-			for i in range(num_elements):
-				elemtype = dm._string_dict.read_string(in_file)
-				name = dm._string_dict.read_string(in_file) if encoding_ver >= 4 else get_str(in_file)
-				id = uuid.UUID(bytes_le = in_file.read(16)) # little-endian
+			for elemtype,name,id in reader.read_element_headers():
 				dm.add_element(name,elemtype,id)
 			
-			# attributes
-			def get_value(attr_type,from_array = False):
-				if attr_type == Element:
-					element_index = get_int(in_file)
-					if element_index == -1:
-						return None
-					elif element_index == -2:
-						return dm.add_element("Missing element",id=uuid.UUID(hex=get_str(in_file)),_is_placeholder=True)
-					else:
-						return dm.elements[element_index]
-					
-				elif attr_type == str:		return get_str(in_file) if encoding_ver < 4 or from_array else dm._string_dict.read_string(in_file)
-				elif attr_type == int:		return get_int(in_file)
-				elif attr_type == float:	return get_float(in_file)
-				elif attr_type == bool:		return get_bool(in_file)
-					
-				elif attr_type == Vector2:		return Vector2(get_vec(in_file,2))
-				elif attr_type == Vector3:		return Vector3(get_vec(in_file,3))
-				elif attr_type == Angle:		return Angle(get_vec(in_file,3))
-				elif attr_type == Vector4:		return Vector4(get_vec(in_file,4))
-				elif attr_type == Quaternion:	return Quaternion(get_vec(in_file,4))
-				elif attr_type == Matrix:
-					out = []
-					for i in range(4): out.append(get_vec(in_file,4))
-					return Matrix(out)
-					
-				elif attr_type == Color:		return get_color(in_file)
-				elif attr_type == Time: return Time.from_int(get_int(in_file))
-				elif attr_type == Binary: return Binary(in_file.read(get_int(in_file)))
-					
-				else:
-					raise TypeError("Cannot read attributes of type {}".format(attr_type))
+			def read_lazy(lazy_attr):
+				in_file.seek(lazy_attr.offset)
+				return reader.get_attribute(lazy_attr.type)
 			
+			# attributes
+			parallel = [] # (element, name, type, payload) of arrays left for the worker pool
 			for elem in dm.elements:
 				if elem._is_placeholder: continue
-				#print(elem.name,"@",in_file.tell())
 				num_attributes = get_int(in_file)
 				for i in range(num_attributes):
-					start = in_file.tell()
-					name = dm._string_dict.read_string(in_file)
-					attr_type = _get_dmx_id_type(encoding,encoding_ver,get_byte(in_file))
-					#print("\t",name,"@",start,attr_type)
-					if attr_type in _dmxtypes:
-						elem[name] = get_value(attr_type)
-					elif attr_type in _dmxtypes_array:
-						array_len = get_int(in_file)
-						arr = elem[name] = attr_type()
-						arr_item_type = _get_single_type(attr_type)
-						for x in range(array_len):
-							arr.append( get_value(arr_item_type,from_array=True) )
-		
-		dm._string_dict = None
+					name,attr_type = reader.read_attribute_header()
+					if lazy:
+						collections.OrderedDict.__setitem__(elem,name,_LazyAttribute(attr_type,in_file.tell(),read_lazy))
+						reader.skip_value(attr_type)
+					elif workers > 1 and attr_type in _dmxtypes_array and attr_type.type_str:
+						offset = in_file.tell()
+						reader.skip_value(attr_type)
+						if in_file.tell() - offset >= _parallel_min_bytes:
+							collections.OrderedDict.__setitem__(elem,name,None) # keeps the attribute's position
+							parallel.append((elem,name,attr_type,in_file.data[offset:in_file.tell()]))
+						else:
+							in_file.seek(offset)
+							elem[name] = reader.get_attribute(attr_type)
+					else:
+						elem[name] = reader.get_attribute(attr_type)
+			
+			if parallel:
+				from concurrent import futures
+				# NumPy wraps each payload without creating per-item objects, so threads suffice; building lists of values holds the GIL, so needs processes
+				executor = futures.ThreadPoolExecutor if packed and numpy else futures.ProcessPoolExecutor
+				with executor(workers) as pool:
+					arrays = pool.map(_decode_array, *zip(*[(attr_type,payload,packed) for elem,name,attr_type,payload in parallel]))
+					for (elem,name,attr_type,payload),arr in zip(parallel,arrays):
+						elem[name] = arr
+		
 		return dm
 	finally:
-		if in_file: in_file.close()
+		if file_handle: file_handle.close()
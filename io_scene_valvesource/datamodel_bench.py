@@ -0,0 +1,183 @@
+#  The MIT License (MIT)
+#
+#  Copyright (c) 2013 Tom Edwards contact@steamreview.org
+#
+#  Permission is hereby granted, free of charge, to any person obtaining a copy
+#  of this software and associated documentation files (the "Software"), to deal
+#  in the Software without restriction, including without limitation the rights
+#  to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+#  copies of the Software, and to permit persons to whom the Software is
+#  furnished to do so, subject to the following conditions:
+#
+#  The above copyright notice and this permission notice shall be included in
+#  all copies or substantial portions of the Software.
+#
+#  THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+#  IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+#  FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+#  AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+#  LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+#  OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+#  THE SOFTWARE.
+
+'''Times datamodel.py outside Blender. Run from this folder:
+
+	python datamodel_bench.py --vertices 50000 --elements 500 --channels 20
+
+Each supported encoding is echoed, written and loaded back, and the result compared with the original.
+Exits with status 1 if any round trip does not match.'''
+
+import argparse, os, sys, tempfile, time, tracemalloc
+
+try:
+	from . import datamodel
+except ImportError: # run as a script
+	import datamodel
+
+def build_model(vertices=10000, elements=100, channels=4, strings=False, time_type=datamodel.Time):
+	'''Synthesises a model: one mesh, a chain of joints and an animation with one Vector3 log per channel.
+	If strings is True, every element also carries string attributes and a string array.'''
+	dm = datamodel.DataModel("model",22)
+	root = dm.add_element("root")
+
+	mesh = dm.add_element("mesh","DmeMesh")
+	root["model"] = mesh
+	vd = dm.add_element("bind","DmeVertexData")
+	mesh["currentState"] = vd
+	mesh["baseStates"] = datamodel.make_array([vd],datamodel.Element)
+	vd["vertexFormat"] = datamodel.make_array(["positions","normals","textureCoordinates","jointWeights","jointIndices"],str)
+	vd["jointCount"] = 2
+	vd["positions"] = datamodel.make_array([datamodel.Vector3([i * 0.25,i * 0.5,-i * 0.25]) for i in range(vertices)],datamodel.Vector3)
+	vd["normals"] = datamodel.make_array([datamodel.Vector3([0,0,1])] * vertices,datamodel.Vector3)
+	vd["textureCoordinates"] = datamodel.make_array([datamodel.Vector2([(i % 256) / 256,(i // 256 % 256) / 256]) for i in range(vertices)],datamodel.Vector2)
+	vd["jointWeights"] = datamodel.make_array([0.75,0.25] * vertices,float)
+	vd["jointIndices"] = datamodel.make_array([i % elements if elements else 0 for i in range(vertices * 2)],int)
+	vd["positionsIndices"] = datamodel.make_array(list(range(vertices)),int)
+
+	joints = []
+	for i in range(elements):
+		joint = dm.add_element("joint_{}".format(i),"DmeJoint")
+		transform = dm.add_element("joint_{}".format(i),"DmeTransform")
+		transform["position"] = datamodel.Vector3([i,0,0])
+		transform["orientation"] = datamodel.Quaternion([0,0,0,1])
+		joint["transform"] = transform
+		joint["children"] = datamodel.make_array([],datamodel.Element)
+		if joints: joints[-1]["children"].append(joint)
+		if strings:
+			joint["note"] = "Joint number {} of {}".format(i,elements)
+			joint["tags"] = datamodel.make_array(["tag_{}_{}".format(i,j) for j in range(8)],str)
+		joints.append(joint)
+	root["skeleton"] = datamodel.make_array(joints[:1],datamodel.Element)
+	# elements without attributes, which KeyValues2 writes inline and which must not be mistaken for missing ones
+	root["markers"] = datamodel.make_array([dm.add_element("marker_{}".format(i)) for i in range(2)],datamodel.Element)
+	root["links"] = datamodel.make_array([mesh,None,vd],datamodel.Element) # null entries are written as -1 or ""
+
+	clip = dm.add_element("anim","DmeChannelsClip")
+	root["animationList"] = clip
+	clip["channels"] = datamodel.make_array([],datamodel.Element)
+	for i in range(channels):
+		channel = dm.add_element("channel_{}".format(i),"DmeChannel")
+		layer = dm.add_element("vector3 log","DmeVector3LogLayer")
+		layer["times"] = datamodel.make_array([time_type(frame * 0.5) for frame in range(vertices // 10)],time_type)
+		layer["values"] = datamodel.make_array([datamodel.Vector3([frame,i,0]) for frame in range(vertices // 10)],datamodel.Vector3)
+		channel["log"] = layer
+		if joints: channel["toElement"] = joints[i % len(joints)]["transform"]
+		clip["channels"].append(channel)
+
+	return dm
+
+def _compare(a,b,path,pairs):
+	'''Returns a description of the first difference between two attribute values, or None. Element pairs are appended to pairs.'''
+	if type(a) == datamodel.Element or type(b) == datamodel.Element:
+		if (a is None) != (b is None):
+			return "{}: element {} != {}".format(path,a,b)
+		if a is not None: pairs.append((a,b))
+	elif isinstance(a,float) or isinstance(b,float):
+		if abs(a - b) > 1e-4 * max(1,abs(a)): # float32 in binary, ten decimal places in KeyValues2
+			return "{}: {} != {}".format(path,a,b)
+	elif isinstance(a,(list,datamodel._PackedArray)):
+		if len(a) != len(b): return "{}: length {} != {}".format(path,len(a),len(b))
+		for i,(item_a,item_b) in enumerate(zip(a,b)):
+			difference = _compare(item_a,item_b,"{}[{}]".format(path,i),pairs)
+			if difference: return difference
+	elif a != b:
+		return "{}: {} != {}".format(path,a,b)
+
+def compare_models(original,loaded):
+	'''Returns a description of the first difference between two DataModels, or None. Elements are matched by walking
+	both models from their roots, since binary DMX does not preserve IDs byte-for-byte.'''
+	if len(original.elements) != len(loaded.elements):
+		return "{} elements written, {} read".format(len(original.elements),len(loaded.elements))
+	pairs = [(original.root,loaded.root)]
+	visited = set()
+	while pairs:
+		elem,other = pairs.pop()
+		if elem.id in visited: continue
+		visited.add(elem.id)
+		if (elem.name,elem.type) != (other.name,other.type): return "{} read as {}".format(elem,other)
+		if list(elem.keys()) != list(other.keys()): return "{} attributes differ: {} != {}".format(elem,list(elem.keys()),list(other.keys()))
+		for name in elem:
+			difference = _compare(elem[name],other[name],"{}.{}".format(elem.name,name),pairs)
+			if difference: return difference
+
+def _measure(func):
+	'''Returns func's result, its run time and its peak Python heap use. Tracing slows Python down, so func is run twice.'''
+	start = time.perf_counter()
+	result = func()
+	elapsed = time.perf_counter() - start
+	tracemalloc.start()
+	func()
+	peak = tracemalloc.get_traced_memory()[1]
+	tracemalloc.stop()
+	return result, elapsed, peak
+
+def run(vertices=10000, elements=100, channels=4, strings=False, encodings=None, packed=False, out=sys.stdout):
+	'''Benchmarks every supported encoding, or those named in encodings (e.g. ["binary5","keyvalues21"]). Returns False if a round trip failed.'''
+	ok = True
+	out.write("{:<16}{:>8}{:>12}{:>14}{:>12}{:>12}\n".format("encoding","op","MB/s","elements/s","peak MB","seconds"))
+	for encoding,versions in sorted(datamodel.list_support().items()):
+		for version in versions:
+			if encodings and encoding + str(version) not in encodings: continue
+			if encoding == "keyvalues2": # no type IDs, but supports Time
+				time_type = datamodel.Time
+			else:
+				try:
+					datamodel._get_dmx_type_id(encoding,version,datamodel._TimeArray)
+					time_type = datamodel.Time
+				except ValueError:
+					time_type = float
+
+			dm = build_model(vertices,elements,channels,strings,time_type)
+			num_elements = len(dm.elements)
+			fd,path = tempfile.mkstemp(suffix=".dmx")
+			os.close(fd)
+			try:
+				echoed,echo_time,echo_peak = _measure(lambda: dm.echo(encoding,version))
+				size = len(echoed)
+				del echoed
+				_,write_time,write_peak = _measure(lambda: dm.write(path,encoding,version))
+				size = os.path.getsize(path)
+				loaded,load_time,load_peak = _measure(lambda: datamodel.load(path,packed=packed))
+
+				for op,seconds,peak in [("echo",echo_time,echo_peak),("write",write_time,write_peak),("load",load_time,load_peak)]:
+					out.write("{:<16}{:>8}{:>12.1f}{:>14.0f}{:>12.1f}{:>12.4f}\n".format("{} {}".format(encoding,version),op,
+						size / seconds / 1e6, num_elements / seconds, peak / 1e6, seconds))
+
+				difference = compare_models(dm,loaded)
+				if difference:
+					ok = False
+					out.write("{} {} ROUND TRIP FAILED: {}\n".format(encoding,version,difference))
+			finally:
+				os.remove(path)
+	return ok
+
+if __name__ == "__main__":
+	parser = argparse.ArgumentParser(description="Benchmark datamodel.py encoding and decoding.")
+	parser.add_argument("--vertices",type=int,default=10000)
+	parser.add_argument("--elements",type=int,default=100,help="number of joints")
+	parser.add_argument("--channels",type=int,default=4,help="number of animation channels")
+	parser.add_argument("--strings",action="store_true",help="add string attributes to every joint")
+	parser.add_argument("--packed",action="store_true",help="load fixed-width arrays into packed buffers")
+	parser.add_argument("--encoding",action="append",help="only test this encoding and version, e.g. binary5. Can be repeated.")
+	args = parser.parse_args()
+	sys.exit(0 if run(args.vertices,args.elements,args.channels,args.strings,args.encoding,args.packed) else 1)
@@ -18,18 +18,28 @@
 #
 # ##### END GPL LICENSE BLOCK #####
 
-import bpy, bmesh, subprocess
+import bpy, bmesh, hashlib, io, filecmp
 from bpy import ops
 from mathutils import *
 from math import *
 
 from .utils import *
-from . import datamodel
+from .import_smd import QcDependencyReader
+from . import datamodel, compiler
 
 wm = bpy.types.WindowManager
 if not 'progress_begin' in dir(wm): # instead of requiring 2.67
 	wm.progress_begin = wm.progress_update = wm.progress_end = lambda *args: None
 
+class _HashingFile:
+	'''Passes writes on to a file, hashing them on the way so that output doesn't have to be held in memory to be compared.'''
+	def __init__(self,file):
+		self.file = file
+		self.hash = hashlib.sha1()
+	def write(self,data):
+		self.hash.update(data.encode('utf-8') if type(data) == str else data)
+		return self.file.write(data)
+
 class SMD_OT_Compile(bpy.types.Operator, Logger):
 	bl_idname = "smd.compile_qc"
 	bl_label = "Compile QC"
@@ -37,19 +47,49 @@ class SMD_OT_Compile(bpy.types.Operator, Logger):
 
 	filepath = bpy.props.StringProperty(name="File path", description="QC to compile", maxlen=1024, default="", subtype='FILE_PATH')
 	
+	invoked = False
+	
 	@classmethod
 	def poll(self,context):
 		return len(p_cache.qc_paths) > 0 and gamePathValid() and studiomdlPathValid()
 
+	def invoke(self,context,event):
+		self.invoked = True # so that execute() can go modal
+		return self.execute(context)
+
 	def execute(self,context):
-		num = self.compileQCs(self.properties.filepath)
+		if p_cache.export_thread and p_cache.export_thread.is_alive(): # it may still be writing files that the QCs read
+			self.report({'ERROR'},"Cannot compile while a background export or compile is running")
+			return {'CANCELLED'}
+		
+		if self.invoked and context.scene.smd_export_background:
+			self.compileJob = SMD_OT_Compile.prepareCompile(self,self.properties.filepath)
+			if self.compileJob:
+				return SMD_OT_Compile.startBackgroundJob(self,context,len(self.compileJob[2]))
+			num = 0
+		else:
+			num = self.compileQCs(self.properties.filepath)
+		self.reportCompile(num)
+		return {'FINISHED'}
+	
+	def reportCompile(self,num):
 		#if num > 1:
 		#	bpy.context.window_manager.progress_begin(0,1)
 		if not self.properties.filepath:
 			self.properties.filepath = "QC"
 		self.errorReport("compiled","{} QC".format(getEngineBranchName()),self, num)
 		bpy.context.window_manager.progress_end()
-		return {'FINISHED'}
+	
+	def runBackgroundJob(self): # no bpy access here!
+		try:
+			SMD_OT_Compile.runCompileJob(self)
+		except Exception as err:
+			import traceback
+			traceback.print_exc()
+			self.error("Background compile failed: {}".format(err))
+	
+	def finishBackgroundJob(self):
+		self.reportCompile(self.numGoodCompiles)
 	
 	@classmethod
 	def getQCs(self,path = None):
@@ -68,9 +108,25 @@ class SMD_OT_Compile(bpy.types.Operator, Logger):
 			out = getQCs(path + ext)
 		return out
 	
-	def compileQCs(self,path=None):
+	def compileQCs(self,path=None,changed_only=False):
+		'''Runs studiomdl on the given QC, or on all QCs matched by the scene. If changed_only is True, QCs whose inputs are unchanged
+		since they last compiled successfully are skipped and counted in self.countUpToDateQCs.'''
+		job = SMD_OT_Compile.prepareCompile(self,path)
+		if not job:
+			return 0
+		
+		num_finished = 0
+		def compileProgress(qc):
+			nonlocal num_finished
+			num_finished += 1
+			bpy.context.window_manager.progress_update(num_finished / (len(job[2])+1))
+		return SMD_OT_Compile.runCompile(self,*job,changed_only=changed_only,on_progress=compileProgress)
+	
+	def prepareCompile(self,path=None):
+		'''Finds the QCs to compile and saves any which are open in Blender. Returns the arguments for runCompile(), or None if there is nothing to compile.'''
 		scene = bpy.context.scene
 		print("\n")
+		self.countUpToDateQCs = 0
 
 		studiomdl_path = os.path.join(bpy.path.abspath(scene.smd_studiomdl_custom_path),"studiomdl.exe")
 
@@ -78,37 +134,105 @@ class SMD_OT_Compile(bpy.types.Operator, Logger):
 			p_cache.qc_paths = [path]
 		else:
 			p_cache.qc_paths = SMD_OT_Compile.getQCs()
-		num_good_compiles = 0
 		if len( p_cache.qc_paths ) == 0:
 			self.error("Cannot compile, no QCs provided. The Blender Source Tools do not generate QCs.")
+			return None
 		elif not os.path.exists(studiomdl_path):
 			self.error( "Could not execute studiomdl from \"{}\"".format(studiomdl_path) )
-		else:
-			i = 0
-			num_qcs = len(p_cache.qc_paths)
-			for qc in p_cache.qc_paths:
-				bpy.context.window_manager.progress_update((i+1) / (num_qcs+1))
-				# save any version of the file currently open in Blender
-				qc_mangled = qc.lower().replace('\\','/')
-				for candidate_area in bpy.context.screen.areas:
-					if candidate_area.type == 'TEXT_EDITOR' and candidate_area.spaces[0].text and candidate_area.spaces[0].text.filepath.lower().replace('\\','/') == qc_mangled:
-						oldType = bpy.context.area.type
-						bpy.context.area.type = 'TEXT_EDITOR'
-						bpy.context.area.spaces[0].text = candidate_area.spaces[0].text
-						ops.text.save()
-						bpy.context.area.type = oldType
-						break #what a farce!
-				
-				print( "Running studiomdl for \"{}\"...\n".format(os.path.basename(qc)) )
-				studiomdl = subprocess.Popen([studiomdl_path, "-nop4", "-game", getGamePath(), qc])
-				studiomdl.communicate()
-
-				if studiomdl.returncode == 0:
-					num_good_compiles += 1
+			return None
+		
+		for qc in p_cache.qc_paths:
+			# save any version of the file currently open in Blender
+			qc_mangled = qc.lower().replace('\\','/')
+			for candidate_area in bpy.context.screen.areas:
+				if candidate_area.type == 'TEXT_EDITOR' and candidate_area.spaces[0].text and candidate_area.spaces[0].text.filepath.lower().replace('\\','/') == qc_mangled:
+					oldType = bpy.context.area.type
+					bpy.context.area.type = 'TEXT_EDITOR'
+					bpy.context.area.spaces[0].text = candidate_area.spaces[0].text
+					ops.text.save()
+					bpy.context.area.type = oldType
+					break #what a farce!
+		
+		return studiomdl_path, getGamePath(), list(p_cache.qc_paths), scene.smd_qc_jobs, getEngineBranchName()
+	
+	def runCompile(self,studiomdl_path,game_path,qc_paths,max_jobs,engine_branch="",changed_only=False,on_progress=None):
+		'''Compiles QCs found by prepareCompile(). Doesn't touch bpy, so can run on a background thread.
+		on_progress(qc) is called as each QC is compiled or found to be up to date. Returns the number of successful compiles.'''
+		num_good_compiles = self.countUpToDateQCs = 0
+		# a different compiler or target game needs a recompile even if the QC's inputs are unchanged
+		settings = (studiomdl_path, fileSignature(studiomdl_path), game_path, engine_branch)
+		qc_inputs = collections.OrderedDict()
+		for qc in qc_paths:
+			reader = QcDependencyReader()
+			inputs = (settings, { input_path:fileSignature(input_path) for input_path in reader.read(qc) })
+			if changed_only and reader.complete and p_cache.compiled_qcs.get(qc) == inputs: # can't skip a QC whose inputs aren't all known
+				print( "\"{}\" is up to date".format(os.path.basename(qc)) )
+				self.countUpToDateQCs += 1
+				if on_progress: on_progress(qc)
+			else:
+				qc_inputs[qc] = inputs
+		
+		num_jobs = min(compiler.getJobCount(max_jobs),len(qc_inputs))
+		if num_jobs:
+			print( "Running studiomdl for {} QC{}, {} at a time...\n".format(len(qc_inputs),"" if len(qc_inputs) == 1 else "s",num_jobs) )
+		def compileFinished(qc,returncode,output):
+			nonlocal num_good_compiles
+			print( "studiomdl output for \"{}\":\n{}".format(os.path.basename(qc),output) )
+			
+			if returncode == 0:
+				num_good_compiles += 1
+				p_cache.compiled_qcs[qc] = qc_inputs[qc]
+			else:
+				p_cache.compiled_qcs.pop(qc,None)
+				if returncode == None:
+					self.error("Could not run studiomdl for {}: {}".format(os.path.basename(qc),output))
 				else:
 					self.error("Compile of {} failed. Check the console for details".format(os.path.basename(qc)))
-				i+=1
+			if on_progress: on_progress(qc)
+		
+		compiler.compileQCs(studiomdl_path, game_path, list(qc_inputs), num_jobs, compileFinished)
 		return num_good_compiles
+	
+	# Runs self.compileJob on a background thread, posting progress for modal()
+	def runCompileJob(self,changed_only=False):
+		def compileProgress(qc):
+			self.jobsDone += 1
+			self.messages.put("Finished {}".format(os.path.basename(qc)))
+		self.numGoodCompiles = SMD_OT_Compile.runCompile(self,*self.compileJob,changed_only=changed_only,on_progress=compileProgress)
+	
+	# Runs self.runBackgroundJob() on a thread, while modal() reports progress and then calls self.finishBackgroundJob()
+	def startBackgroundJob(self,context,jobsTotal):
+		import threading, queue
+		wm = context.window_manager
+		self.jobsDone = 0
+		self.jobsTotal = jobsTotal
+		self.messages = queue.Queue()
+		
+		# The thread itself marks a job as running, so nothing is left set if this operator's modal handler is torn down
+		self.thread = p_cache.export_thread = threading.Thread(target=self.runBackgroundJob)
+		self.thread.start()
+		self.timer = wm.event_timer_add(0.1,context.window)
+		wm.modal_handler_add(self)
+		wm.progress_begin(0,1)
+		return {'RUNNING_MODAL'}
+	
+	def modal(self, context, event):
+		if event.type != 'TIMER':
+			return {'PASS_THROUGH'}
+		
+		while not self.messages.empty():
+			self.report({'INFO'},self.messages.get())
+		context.window_manager.progress_update(self.jobsDone / max(self.jobsTotal,1))
+		if self.thread.is_alive():
+			return {'PASS_THROUGH'}
+		
+		self.cancel(context)
+		self.finishBackgroundJob()
+		return {'FINISHED'}
+	
+	def cancel(self, context): # also called by Blender if the modal handler is removed, e.g. when a file is loaded
+		context.window_manager.event_timer_remove(self.timer)
+		context.window_manager.progress_end()
 
 class SmdExporter(bpy.types.Operator, Logger):
 	'''Export SMD or DMX files and compile them with QC scripts'''
@@ -126,10 +250,16 @@ class SmdExporter(bpy.types.Operator, Logger):
 	groupIndex = bpy.props.IntProperty(default=-1,options={'HIDDEN'})
 	
 	default_armature_subdir = "anims"
+	invoked = False
+	writeQueue = None # (filepath, serialise, binary) awaiting the background thread
 
 	def execute(self, context):
 		props = self.properties
 		#bpy.context.window_manager.progress_begin(0,1)
+		
+		if p_cache.export_thread and p_cache.export_thread.is_alive():
+			self.report({'ERROR'},"Cannot export while a background export or compile is running")
+			return {'CANCELLED'}
 
 		# Misconfiguration?
 		if props.exportMode == 'NONE':
@@ -167,6 +297,7 @@ class SmdExporter(bpy.types.Operator, Logger):
 		ops.ed.undo_push(message=self.bl_label)
 		
 		try:
+			self.writeQueue = [] if self.invoked and context.scene.smd_export_background else None
 			bpy.context.tool_settings.use_keyframe_insert_auto = False
 			bpy.context.tool_settings.use_keyframe_insert_keyingset = False
 			
@@ -185,7 +316,7 @@ class SmdExporter(bpy.types.Operator, Logger):
 			bpy.context.scene.layers = [True] * len(bpy.context.scene.layers)
 
 			# check export mode and perform appropriate jobs
-			self.countSMDs = self.attemptedExports = 0
+			self.countSMDs = self.attemptedExports = self.countUnchanged = 0
 			if props.exportMode == 'SINGLE':
 				ob = context.active_object
 				group_name = None
@@ -246,20 +377,22 @@ class SmdExporter(bpy.types.Operator, Logger):
 						if should_export:
 							self.exportObject(context,object)
 
-			jobMessage = "exported"
-
+			self.numGoodCompiles = self.compileJob = None
 			if self.attemptedExports == 0:
 				self.error("Found no valid objects for export")
 			elif context.scene.smd_qc_compile and context.scene.smd_qc_path:
 				# ...and compile the QC
 				if not SMD_OT_Compile.poll(context):
 					print("Skipping QC compile step: context incorrect\n")
+				elif self.writeQueue != None: # compile once the files are written
+					self.numGoodCompiles = 0
+					self.compileJob = SMD_OT_Compile.prepareCompile(self)
 				else:
-					num_good_compiles = SMD_OT_Compile.compileQCs(self)
-					jobMessage += " and {} QC{} compiled ({}/{})".format(num_good_compiles, "" if num_good_compiles == 1 else "s", getEngineBranchName(), os.path.basename(getGamePath()))
+					self.numGoodCompiles = SMD_OT_Compile.compileQCs(self,changed_only=True)
 					print("\n")
-				
-			self.errorReport(jobMessage,"file",self,self.countSMDs)
+			
+			if self.writeQueue == None:
+				self.reportExport()
 		finally:
 			# Clean everything up
 			ops.ed.undo_push(message=self.bl_label)
@@ -277,9 +410,43 @@ class SmdExporter(bpy.types.Operator, Logger):
 			
 			props.groupIndex = -1
 			
-			bpy.context.window_manager.progress_end()
+			if self.writeQueue == None:
+				bpy.context.window_manager.progress_end()
 
+		if self.writeQueue != None:
+			return SMD_OT_Compile.startBackgroundJob(self,context,len(self.writeQueue) + (len(self.compileJob[2]) if self.compileJob else 0))
 		return {'FINISHED'}
+	
+	def reportExport(self):
+		jobMessage = "exported"
+		if self.numGoodCompiles != None:
+			jobMessage += " and {} QC{} compiled ({}/{})".format(self.numGoodCompiles, "" if self.numGoodCompiles == 1 else "s", getEngineBranchName(), os.path.basename(getGamePath()))
+			if self.countUpToDateQCs:
+				jobMessage += " ({} up to date)".format(self.countUpToDateQCs)
+		if self.countUnchanged:
+			jobMessage += " ({} unchanged)".format(self.countUnchanged)
+		self.errorReport(jobMessage,"file",self,self.countSMDs)
+	
+	# Writes the queued files and compiles QCs on a thread, while modal() reports progress. Baking has already happened.
+	modal = SMD_OT_Compile.modal
+	cancel = SMD_OT_Compile.cancel
+	
+	def runBackgroundJob(self): # no bpy access here!
+		try:
+			for filepath,serialise,binary in self.writeQueue:
+				written = self.writeIfChanged(filepath,serialise,binary)
+				self.jobsDone += 1
+				self.messages.put("{} {}".format("Wrote" if written else "Unchanged:",os.path.basename(filepath)))
+			
+			if self.compileJob:
+				SMD_OT_Compile.runCompileJob(self,changed_only=True)
+		except Exception as err:
+			import traceback
+			traceback.print_exc()
+			self.error("Background export failed: {}".format(err))
+	
+	def finishBackgroundJob(self):
+		self.reportExport()
 
 	# indirection to support batch exporting
 	def exportObject(self,context,object,groupIndex=-1):
@@ -343,11 +510,58 @@ class SmdExporter(bpy.types.Operator, Logger):
 									if self.writeSMD(object,-1,os.path.join(path, ad.action.name + getFileExt()), ANIM):
 										self.countSMDs += 1
 
+	def writeOutput(self,filepath,serialise,binary=False):
+		'''Calls serialise(file) to write filepath, with a file opened in text or binary mode. In background mode this happens later, on the export thread.'''
+		if self.writeQueue == None:
+			self.writeIfChanged(filepath,serialise,binary)
+		else:
+			self.writeQueue.append((filepath,serialise,binary))
+
+	def writeIfChanged(self,filepath,serialise,binary=False):
+		'''Streams serialise(file) to a temporary file, hashing it on the way, and only replaces filepath if its contents differ.
+		This way unchanged exports don't trigger a QC compile. Returns True if the file was written.'''
+		filepath = os.path.realpath(filepath)
+		temp_path = filepath + ".tmp"
+		
+		try:
+			with open(temp_path,'wb' if binary else 'w') as file:
+				hashing_file = _HashingFile(file)
+				serialise(hashing_file)
+		except (PermissionError, FileNotFoundError) as err:
+			self.error("Could not create {}. Python reports: {}.".format(os.path.basename(filepath),err))
+			return False
+		except:
+			if os.path.exists(temp_path): os.remove(temp_path) # don't leave half-written output behind
+			raise
+		digest = hashing_file.hash.hexdigest()
+		
+		try:
+			mtime = os.path.getmtime(filepath)
+			# not written by this session, or modified since? Compare with what's on disk.
+			if p_cache.export_hashes.get(filepath) == (digest,mtime) or filecmp.cmp(temp_path,filepath,shallow=False):
+				os.remove(temp_path)
+				p_cache.export_hashes[filepath] = (digest,mtime)
+				self.countUnchanged += 1
+				print("- Unchanged, not rewritten")
+				return False
+		except OSError:
+			pass # file is missing or unreadable; replace it
+		
+		try:
+			os.replace(temp_path,filepath)
+		except OSError as err:
+			os.remove(temp_path)
+			self.error("Could not create {}. Python reports: {}.".format(os.path.basename(filepath),err))
+			return False
+		p_cache.export_hashes[filepath] = (digest,os.path.getmtime(filepath))
+		return True
+
 	def invoke(self, context, event):
 		if self.properties.exportMode == 'NONE':
 			ops.wm.call_menu(name="SMD_MT_ExportChoice")
 			return {'PASS_THROUGH'}
 		else: # a UI element has chosen a mode for us
+			self.invoked = True # so that execute() can go modal
 			return self.execute(context)
 
 	# nodes block
@@ -1017,28 +1231,35 @@ class SmdExporter(bpy.types.Operator, Logger):
 		if smd.isDMX:
 			return self.writeDMX(object, groupIndex, filepath, smd_type, quiet )
 		
-		try:
-			smd.file = open(filepath, 'w')
-		except Exception as err:
-			self.error("Could not create SMD. Python reports: {}.".format(err))
 		print("-",os.path.realpath(filepath))
-			
-		smd.file.write("version 1\n")
-
-		# these write empty blocks if no armature is found. Required!
-		self.writeBones(quiet = smd.jobType == FLEX)
-		self.writeFrames()
-
-		if smd.m:
-			if smd.jobType in [REF,PHYS]:
-				self.writePolys()
-				print("- Exported {} materials".format(len(smd.materials_used)))
-				for mat in smd.materials_used:
-					print("   " + mat)
-			elif smd.jobType == FLEX:
-				self.writeShapes()
-
-		smd.file.close()
+		
+		def writeBlocks(file):
+			smd.file = file
+			smd.file.write("version 1\n")
+
+			# these write empty blocks if no armature is found. Required!
+			self.writeBones(quiet = smd.jobType == FLEX)
+			self.writeFrames()
+
+			if smd.m:
+				if smd.jobType in [REF,PHYS]:
+					self.writePolys()
+					print("- Exported {} materials".format(len(smd.materials_used)))
+					for mat in smd.materials_used:
+						print("   " + mat)
+				elif smd.jobType == FLEX:
+					self.writeShapes()
+		
+		if self.writeQueue == None:
+			self.writeOutput(filepath,writeBlocks) # straight to disk
+		else: # the blocks read bpy data, so must be built now
+			buffer = io.StringIO()
+			writeBlocks(buffer)
+			def writeBuffer(file):
+				file.write(buffer.getvalue())
+				buffer.close()
+			self.writeOutput(filepath,writeBuffer)
+		smd.file = None
 		if not quiet: printTimeMessage(smd.startTime,smd.jobName,"export")
 
 		return True
@@ -1244,22 +1465,22 @@ class SmdExporter(bpy.types.Operator, Logger):
 				bench("verts")
 				
 				
-				vertex_data["positions"] = datamodel.make_array(pos,datamodel.Vector3)
-				vertex_data["positionsIndices"] = datamodel.make_array(Indices,int)
+				vertex_data["positions"] = datamodel.make_array(pos,datamodel.Vector3,packed=True)
+				vertex_data["positionsIndices"] = datamodel.make_array(Indices,int,packed=True)
 				
-				vertex_data["normals"] = datamodel.make_array(norms,datamodel.Vector3)
-				vertex_data["normalsIndices"] = datamodel.make_array(Indices,int)
+				vertex_data["normals"] = datamodel.make_array(norms,datamodel.Vector3,packed=True)
+				vertex_data["normalsIndices"] = datamodel.make_array(Indices,int,packed=True)
 				
-				vertex_data["textureCoordinates"] = datamodel.make_array(texco,datamodel.Vector2)
-				vertex_data["textureCoordinatesIndices"] = datamodel.make_array(texcoIndices,int)
+				vertex_data["textureCoordinates"] = datamodel.make_array(texco,datamodel.Vector2,packed=True)
+				vertex_data["textureCoordinatesIndices"] = datamodel.make_array(texcoIndices,int,packed=True)
 				
 				if jointCount:
-					vertex_data["jointWeights"] = datamodel.make_array(jointWeights,float)
-					vertex_data["jointIndices"] = datamodel.make_array(jointIndices,int)
+					vertex_data["jointWeights"] = datamodel.make_array(jointWeights,float,packed=True)
+					vertex_data["jointIndices"] = datamodel.make_array(jointIndices,int,packed=True)
 				
 				if has_shapes:
-					vertex_data["balance"] = datamodel.make_array(balance,float)
-					vertex_data["balanceIndices"] = datamodel.make_array(Indices,int)
+					vertex_data["balance"] = datamodel.make_array(balance,float,packed=True)
+					vertex_data["balanceIndices"] = datamodel.make_array(Indices,int,packed=True)
 				
 				bench("insert")
 				face_sets = {}
@@ -1539,13 +1760,11 @@ class SmdExporter(bpy.types.Operator, Logger):
 		
 		benchReset()
 		bpy.context.window_manager.progress_update(0.99)
-		try:
-			if bpy.context.scene.smd_use_kv2:
-				dm.write(filepath,"keyvalues2",1)
-			else:
-				dm.write(filepath,"binary",DatamodelEncodingVersion())
-		except (PermissionError, FileNotFoundError) as err:
-			self.error("Could not create DMX. Python reports: {}.".format(err))
+		if bpy.context.scene.smd_use_kv2:
+			encoding = ("keyvalues2",1)
+		else:
+			encoding = ("binary",DatamodelEncodingVersion())
+		self.writeOutput(filepath,lambda file: dm.write(file,*encoding),binary=encoding[0] != "keyvalues2")
 		bench("Writing")
 		print("DMX export took",time.time() - start,"\n")
 		
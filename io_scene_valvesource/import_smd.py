@@ -22,6 +22,7 @@ import bpy, bmesh, random, collections
 from bpy import ops
 from bpy.props import *
 from .utils import *
+from . import smd_format
 
 class SmdImporter(bpy.types.Operator, Logger):
 	bl_idname = "import_scene.smd"
@@ -90,21 +91,19 @@ class SmdImporter(bpy.types.Operator, Logger):
 		bpy.context.window_manager.fileselect_add(self)
 		return {'RUNNING_MODAL'}
 
-	# Identifies what type of SMD this is. Cannot tell between reference/lod/collision meshes!
-	def scanSMD(self):
+	# Identifies what type of SMD this is from the blocks it contains. Cannot tell between reference/lod/collision meshes!
+	def scanSMD(self,blocks):
 		smd = self.smd
-		for line in smd.file:
-			if line == "triangles\n":
+		for block in blocks:
+			if block == "triangles":
 				smd.jobType = REF
 				print("- This is a mesh")
 				break
-			if line == "vertexanimation\n":
+			if block == "vertexanimation":
 				print("- This is a flex animation library")
 				smd.jobType = FLEX
 				break
 
-		# Finished the file
-
 		if smd.jobType == None:
 			print("- This is a skeltal animation or pose") # No triangles, no flex - must be animation
 			if smd.append:
@@ -113,8 +112,6 @@ class SmdImporter(bpy.types.Operator, Logger):
 						smd.jobType = ANIM
 			if smd.jobType == None: # support importing animations on their own
 				smd.jobType = ANIM_SOLO
-
-		smd.file.seek(0,0) # rewind to start of file
 		
 	# joins up "quoted values" that would otherwise be delimited, removes comments
 	def parseQuoteBlockedLine(self,line,lower=True):
@@ -185,24 +182,15 @@ class SmdImporter(bpy.types.Operator, Logger):
 		return words
 
 	# Runs instead of readBones if an armature already exists, testing the current SMD's nodes block against it.
-	def validateBones(self,target):
+	def validateBones(self,target,nodes):
 		smd = self.smd
 		missing = 0
 		validated = 0
-		for line in smd.file:
-			if smdBreak(line):
-				break
-			if smdContinue(line):
-				continue
-		
-			values = self.parseQuoteBlockedLine(line,lower=False)
-			values[0] = int(values[0])
-			values[2] = int(values[2])
-
-			targetBone = target.data.bones.get(values[1]) # names, not IDs, are the key
+		for node in nodes:
+			targetBone = target.data.bones.get(node.name) # names, not IDs, are the key
 			if not targetBone:
 				for bone in target.data.bones:
-					if getObExportName(bone) == values[1]:
+					if getObExportName(bone) == node.name:
 						targetBone = bone
 			
 			if targetBone:
@@ -210,10 +198,10 @@ class SmdImporter(bpy.types.Operator, Logger):
 			else:
 				missing += 1
 				parentName = targetBone.parent.name if targetBone and targetBone.parent else ""
-				if smd.boneIDs.get(values[2]) != parentName:
-					smd.phantomParentIDs[values[0]] = values[2]	
+				if smd.boneIDs.get(node.parent) != parentName:
+					smd.phantomParentIDs[node.id] = node.parent
 
-			smd.boneIDs[values[0]] = targetBone.name if targetBone else values[1]
+			smd.boneIDs[node.id] = targetBone.name if targetBone else node.name
 		
 		if smd.a != target:
 			removeObject(smd.a)
@@ -222,7 +210,7 @@ class SmdImporter(bpy.types.Operator, Logger):
 		print("- Validated {} bones against armature \"{}\"{}".format(validated, smd.a.name, " (could not find {})".format(missing) if missing > 0 else ""))
 
 	# nodes
-	def readNodes(self):
+	def readNodes(self,nodes):
 		smd = self.smd
 		if smd.append:
 			if not smd.a:
@@ -230,7 +218,7 @@ class SmdImporter(bpy.types.Operator, Logger):
 			if smd.a:
 				if smd.jobType == REF:
 					smd.jobType = REF_ADD
-				self.validateBones(smd.a)
+				self.validateBones(smd.a,nodes)
 				return
 
 		# Got this far? Then this is a fresh import which needs a new armature.
@@ -243,20 +231,13 @@ class SmdImporter(bpy.types.Operator, Logger):
 
 		ops.object.mode_set(mode='EDIT',toggle=False)
 
-		# Read bone definitions from disc
-		for line in smd.file:		
-			if smdBreak(line):
-				break
-			if smdContinue(line):
-				continue
-
-			values = self.parseQuoteBlockedLine(line,lower=False)
-		
-			bone = smd.a.data.edit_bones.new(values[1])
+		# Create bones from the nodes block
+		for node in nodes:
+			bone = smd.a.data.edit_bones.new(node.name)
 			bone.tail = 0,5,0 # Blender removes zero-length bones
 
-			smd.boneIDs[int(values[0])] = bone.name
-			boneParents[bone.name] = int(values[2])
+			smd.boneIDs[node.id] = bone.name
+			boneParents[bone.name] = node.parent
 
 		# Apply parents now that all bones exist
 		for bone in smd.a.data.edit_bones:
@@ -308,72 +289,50 @@ class SmdImporter(bpy.types.Operator, Logger):
 
 		return a
 
-	def readFrames(self):
+	def readFrames(self,frames):
 		smd = self.smd
 		# We only care about pose data in some SMD types
 		if smd.jobType not in [ REF, ANIM, ANIM_SOLO ]:
-			if smd.jobType == FLEX: smd.shapeNames = {}
-			for line in smd.file:
-				line = line.strip()
-				if smdBreak(line): return
-				if smd.jobType == FLEX and line.startswith("time"):
-					for c in line:
-						if c in ['#',';','/']:
-							pos = line.index(c)
-							frame = line[:pos].split()[1]
-							if c == '/': pos += 1
-							smd.shapeNames[frame] = line[pos+1:].strip()
+			if smd.jobType == FLEX:
+				smd.shapeNames = { frame.time:frame.name for frame in frames if frame.name != None }
+			return
 
 		a = smd.a
 		bones = a.data.bones
 		bpy.context.scene.objects.active = smd.a
 		ops.object.mode_set(mode='POSE')
 
-		num_frames = 0
 		keyframes = collections.defaultdict(dict)
 		phantom_keyframes = collections.defaultdict(dict)	# bones that aren't in the reference skeleton
 		
-		for line in smd.file:
-			if smdBreak(line):
-				break
-			if smdContinue(line):
-				continue
+		if len(frames) > 1: # frame numbers are dummy values, all frames are equally spaced
+			if smd.jobType == ANIM_SOLO:
+				ops.pose.armature_apply()
+			if smd.jobType == REF:
+				self.warning("Found animation in reference mesh \"{}\", ignoring!".format(smd.jobName))
+				frames = frames[:1]
+		num_frames = len(frames)
+		
+		for f,frame in enumerate(frames):
+			transforms = frame.transforms
+			for i,boneID in enumerate(frame.bones):
+				pos = Vector(transforms[i*6:i*6+3])
+				rot = Euler(transforms[i*6+3:i*6+6])
 				
-			values = line.split()
-
-			if values[0] == "time": # frame number is a dummy value, all frames are equally spaced
-				if num_frames > 0:
-					if smd.jobType == ANIM_SOLO and num_frames == 1:
-						ops.pose.armature_apply()
-					if smd.jobType == REF:
-						self.warning("Found animation in reference mesh \"{}\", ignoring!".format(smd.jobName))
-						for line in smd.file: # skip to end of block						
-							if smdBreak(line):
-								break
-							if smdContinue(line):
-								continue
-				num_frames += 1
-				continue
+				keyframe = KeyFrame()
+				keyframe.matrix = Matrix.Translation(pos) * rot.to_matrix().to_4x4()
+				keyframe.pos = keyframe.rot = True
 				
-			# Read SMD data
-			pos = Vector([float(values[1]), float(values[2]), float(values[3])])
-			rot = Euler([float(values[4]), float(values[5]), float(values[6])])
-			
-			keyframe = KeyFrame()
-			keyframe.matrix = Matrix.Translation(pos) * rot.to_matrix().to_4x4()
-			keyframe.pos = keyframe.rot = True
-			
-			# store the keyframe
-			values[0] = int(values[0])
-			try:
-				bone = smd.a.pose.bones[ smd.boneIDs[values[0]] ]
-				if not bone.parent:
-					keyframe.matrix = getUpAxisMat(smd.upAxis) * keyframe.matrix
-				keyframes[bone][num_frames-1] = keyframe
-			except KeyError:
-				if not smd.phantomParentIDs.get(values[0]):
-					keyframe.matrix = getUpAxisMat(smd.upAxis) * keyframe.matrix
-				phantom_keyframes[values[0]][num_frames-1] = keyframe
+				# store the keyframe
+				try:
+					bone = smd.a.pose.bones[ smd.boneIDs[boneID] ]
+					if not bone.parent:
+						keyframe.matrix = getUpAxisMat(smd.upAxis) * keyframe.matrix
+					keyframes[bone][f] = keyframe
+				except KeyError:
+					if not smd.phantomParentIDs.get(boneID):
+						keyframe.matrix = getUpAxisMat(smd.upAxis) * keyframe.matrix
+					phantom_keyframes[boneID][f] = keyframe
 			
 		# All frames read, apply phantom bones
 		for ID, parentID in smd.phantomParentIDs.items():		
@@ -484,6 +443,9 @@ class SmdImporter(bpy.types.Operator, Logger):
 					keyframes[bone] = {0:keyframes[bone][0]}
 			
 			# Create keyframes
+			upAxisMat = getUpAxisMat(smd.upAxis)
+			legacyRotation = smd.a.data.smd_legacy_rotation
+			legacyInverse = mat_BlenderToSMD.inverted()
 			def ApplyRecursive(bone):
 				if keyframes.get(bone):
 					# Generate curves
@@ -506,35 +468,34 @@ class SmdImporter(bpy.types.Operator, Logger):
 								curve.group = group
 								curvesRot.append(curve)
 					
-					# Key each frame
-					for f,keyframe in keyframes[bone].items():
-						# Transform
-						if smd.a.data.smd_legacy_rotation:
-							keyframe.matrix *= mat_BlenderToSMD.inverted()
-						
-						if bone.parent:
-							if smd.a.data.smd_legacy_rotation: parentMat = bone.parent.matrix * mat_BlenderToSMD
-							else: parentMat = bone.parent.matrix
-							bone.matrix = parentMat * keyframe.matrix
-						else:
-							bone.matrix = getUpAxisMat(smd.upAxis) * keyframe.matrix
+					# Keyframes are relative to the parent bone, but F-Curves are relative to the bone's rest pose. Rest matrices don't
+					# change between frames, so the conversion is calculated here instead of by posing the bone on every frame.
+					if bone.parent:
+						restMat = bone.bone.matrix_local.inverted() * bone.parent.bone.matrix_local
+						if legacyRotation: restMat = restMat * mat_BlenderToSMD
+					else:
+						restMat = bone.bone.matrix_local.inverted() * upAxisMat
+					
+					# Interleaved frame/value pairs for each curve
+					keysLoc = [[] for curve in curvesLoc] if curvesLoc else []
+					keysRot = [[] for curve in curvesRot] if curvesRot else []
+					for f,keyframe in sorted(keyframes[bone].items()):
+						matrix = keyframe.matrix * legacyInverse if legacyRotation else keyframe.matrix
+						basis = restMat * matrix
 						
-						# Key location					
 						if keyframe.pos:
-							for i in range(3):
-								curvesLoc[i].keyframe_points.add(1)
-								curvesLoc[i].keyframe_points[-1].co = [f, bone.location[i]]
-						
-						# Key rotation
+							for i,value in enumerate(basis.to_translation()):
+								keysLoc[i] += [f, value]
 						if keyframe.rot:
-							if smd.rotMode == 'XYZ':
-								for i in range(3):
-									curvesRot[i].keyframe_points.add(1)
-									curvesRot[i].keyframe_points[-1].co = [f, bone.rotation_euler[i]]
-							else:
-								for i in range(4):
-									curvesRot[i].keyframe_points.add(1)
-									curvesRot[i].keyframe_points[-1].co = [f, bone.rotation_quaternion[i]]
+							rot = basis.to_euler() if smd.rotMode == 'XYZ' else basis.to_quaternion()
+							for i,value in enumerate(rot):
+								keysRot[i] += [f, value]
+					
+					# Key each curve in one go
+					for curves,keys in [(curvesLoc,keysLoc),(curvesRot,keysRot)]:
+						for curve,co in zip(curves or [],keys):
+							curve.keyframe_points.add(len(co) // 2)
+							curve.keyframe_points.foreach_set("co", co)
 
 				# Recurse
 				for child in bone.children:
@@ -624,59 +585,8 @@ class SmdImporter(bpy.types.Operator, Logger):
 				if child.type == 'EMPTY':
 					child.layers[smd.layer] = True
 
-	# Remove doubles without removing entire faces
-	def removeDoublesPreserveFaces(self):
-		smd = self.smd
-		for poly in smd.m.data.polygons:
-			poly.select = True
-		
-		def getVertCos(poly):
-			cos = []
-			for vert_index in poly.vertices:
-				cos.append(poly.id_data.vertices[vert_index].co)
-			return cos
-			
-		def getEpsilonNormal(normal):
-			norm_rounded = [0,0,0]
-			for i in range(0,3):
-				norm_rounded[i] = abs(round(normal[i],4))
-			return tuple(norm_rounded)
-		
-		# First pass: make a hashed list of unsigned normals
-		norm_dict = collections.defaultdict(list)
-		for poly in smd.m.data.polygons:
-			norm_dict[getEpsilonNormal(poly.normal)].append(poly.index)
-		
-		# Second pass: for each selected poly, check each poly with a matching normal vector
-		# and determine if it shares the same verts. If it does, deselect it to avoid
-		# destruction during Remove Doubles.
-		for poly in smd.m.data.polygons:
-			if not poly.select: continue
-			norm_tuple = getEpsilonNormal(poly.normal)			
-			poly_verts = getVertCos(poly)
-			
-			for candidate_index in norm_dict[norm_tuple]:
-				if candidate_index == poly.index: continue
-				candidate_poly = smd.m.data.polygons[candidate_index]
-				if not candidate_poly.select: continue
-				candidate_poly_verts = getVertCos(candidate_poly)
-				different = False
-				for poly_vert in poly_verts:
-					if poly_vert not in candidate_poly_verts:
-						different = True
-						break
-				candidate_poly.select = different
-		
-		# Now remove those doubles!
-		ops.object.mode_set(mode='EDIT')
-		ops.mesh.remove_doubles(threshold=0)
-		ops.mesh.select_all(action='INVERT') # FIXME: the 'back' polys will not be connected to the main mesh
-		ops.mesh.remove_doubles(threshold=0)
-		ops.mesh.select_all(action='DESELECT')
-		ops.object.mode_set(mode='OBJECT')
-
 	# triangles block
-	def readPolys(self):
+	def readPolys(self,tris):
 		smd = self.smd
 		if smd.jobType not in [ REF, REF_ADD, PHYS ]:
 			return
@@ -706,99 +616,45 @@ class SmdImporter(bpy.types.Operator, Logger):
 
 		# Initialisation
 		md = smd.m.data
-		lastWindowUpdate = time.time()
-		# Vertex values
-		cos = []
-		norms = []
-		weights = []
-		# Face values
-		uvs = []
-		mats = []
-
-		bm = bmesh.new()
-		bm.from_mesh(md)
-		
-		# *************************************************************************************************
-		# There are two loops in this function: one for polygons which continues until the "end" keyword
-		# and one for the vertices on each polygon that loops three times. We're entering the poly one now.	
-		countPolys = 0
 		badWeights = 0
-		for line in smd.file:
-			line = line.rstrip("\n")
-
-			if line and smdBreak(line): # normally a blank line means a break, but Milkshape can export SMDs with zero-length material names...
-				break
-			if smdContinue(line):
-				continue
-
-			mat, mat_ind = self.getMeshMaterial(line if line else "UndefinedMaterial")
-			mats.append(mat_ind)
-
-			# ***************************************************************
-			# Enter the vertex loop. This will run three times for each poly.
-			vertexCount = 0
-			faceVerts = []
-			for line in smd.file:
-				if smdBreak(line):
-					break
-				if smdContinue(line):
-					continue
-				values = line.split()
-
-				vertexCount+= 1
-				co = []
-				#norm = []
-
-				# Read co-ordinates and normals
-				for i in range(1,4): # 0 is the deprecated bone weight value
-					co.append( float(values[i]) )
-					#norm.append( float(values[i+3]) ) # Blender currenty ignores this data!
-				
-				faceVerts.append( bm.verts.new(co) )
-				
-				# Can't do these in the above for loop since there's only two
-				uvs.append( ( float(values[7]), float(values[8]) ) )
-
-				# Read weightmap data
-				weights.append( [] ) # Blank array, needed in case there's only one weightlink
-				if len(values) > 10 and values[9] != "0": # got weight links?
-					for i in range(10, 10 + (int(values[9]) * 2), 2): # The range between the first and last weightlinks (each of which is *two* values)
-						try:
-							bone = smd.a.data.bones[ smd.boneIDs[int(values[i])] ]
-							weights[-1].append( [ smd.m.vertex_groups[bone.name], float(values[i+1]) ] )
-						except KeyError:
-							badWeights += 1
-				else: # Fall back on the deprecated value at the start of the line
-					try:
-						bone = smd.a.data.bones[ smd.boneIDs[int(values[0])] ]				
-						weights[-1].append( [smd.m.vertex_groups[bone.name], 1.0] )
-					except KeyError:
-						badWeights += 1
 
-				# Three verts? It's time for a new poly
-				if vertexCount == 3:
-					bm.faces.new(faceVerts)
-					break
-
-			# Back in polyland now, with three verts processed.
-			countPolys+= 1
-
-		bm.to_mesh(md)
-		bm.free()
-		md.update()
+		# Each material is looked up once, in the order the SMD first uses it
+		mat_inds = [self.getMeshMaterial(name if name else "UndefinedMaterial")[1] for name in tris.materials]
+
+		# Corners at the same position share a vertex; each kept triangle gets three loops
+		vertCorners, loopVerts, faces = smd_format.weld(tris)
+		countVerts = len(vertCorners)
+		countPolys = len(faces)
+		loopCorners = [f*3+i for f in faces for i in range(3)]
+
+		md.vertices.add(countVerts)
+		md.vertices.foreach_set("co", smd_format.gather(tris.positions,vertCorners,3))
+		md.loops.add(len(loopVerts))
+		md.loops.foreach_set("vertex_index", loopVerts)
+		md.polygons.add(countPolys)
+		md.polygons.foreach_set("loop_start", list(range(0,len(loopVerts),3)))
+		md.polygons.foreach_set("loop_total", [3] * countPolys)
+		md.update(calc_edges=True)
 		
 		if countPolys:	
-			md.polygons.foreach_set("material_index", mats)
+			md.polygons.foreach_set("material_index", [mat_inds[tris.material_indices[f]] for f in faces])
 			
 			md.uv_textures.new()
-			uv_data = md.uv_layers[0].data
-			for i in range(len(uv_data)):
-				uv_data[i].uv = uvs[md.loops[i].vertex_index]
+			md.uv_layers[0].data.foreach_set("uv", smd_format.gather(tris.uvs,loopCorners,2))
 			
-			# Apply vertex groups
-			for i in range(len(md.vertices)):
-				for link in weights[i]:
-					link[0].add( [i], link[1], 'REPLACE' )
+			# Apply vertex groups, with one call for each weight value of each bone
+			linkedVerts = collections.defaultdict(list)
+			link_starts = tris.link_starts
+			for i,corner in enumerate(vertCorners):
+				for link in range(link_starts[corner],link_starts[corner+1]):
+					linkedVerts[tris.link_bones[link],tris.link_weights[link]].append(i)
+			
+			for (boneID,weight),verts in linkedVerts.items():
+				try:
+					bone = smd.a.data.bones[ smd.boneIDs[boneID] ]
+					smd.m.vertex_groups[bone.name].add( verts, weight, 'REPLACE' )
+				except KeyError:
+					badWeights += len(verts)
 			
 			ops.object.select_all(action="DESELECT")
 			smd.m.select = True
@@ -806,11 +662,6 @@ class SmdImporter(bpy.types.Operator, Logger):
 			
 			ops.object.shade_smooth()
 			
-			for poly in smd.m.data.polygons:
-				poly.select = True		
-			
-			self.removeDoublesPreserveFaces()
-			
 			smd.m.show_wire = smd.jobType == PHYS
 
 			if smd.upAxis == 'Y':
@@ -822,7 +673,7 @@ class SmdImporter(bpy.types.Operator, Logger):
 			print("- Imported {} polys".format(countPolys))
 
 	# vertexanimation block
-	def readShapes(self):
+	def readShapes(self,shapes):
 		smd = self.smd
 		if smd.jobType is not FLEX:
 			return
@@ -858,75 +709,63 @@ class SmdImporter(bpy.types.Operator, Logger):
 		bad_vta_verts = num_shapes = 0
 		md = smd.m.data
 		
-		for line in smd.file:
-			line = line.rstrip("\n")
-			
-			if smdBreak(line):
-				break
-			if smdContinue(line):
-				continue
-			
-			values = line.split()
-
-			if values[0] == "time":
-				shape_name = smd.shapeNames.get(values[1])
-				if smd.vta_ref == None:
-					smd.m.shape_key_add(shape_name if shape_name else "Basis")
-					vta_ref = smd.vta_ref = smd.m.copy()
-					vta_ref.name = "VTA vertices"
-					bpy.context.scene.objects.link(vta_ref)
-					vd = vta_ref.data = bpy.data.meshes.new(vta_ref.name)
-				elif making_base_shape:
-					vd.vertices.add(len(vta_cos)/3)
-					vd.vertices.foreach_set("co",vta_cos)
-					del vta_cos
-					
-					#mod = vta_ref.modifiers.new(name="VTA Shrinkwrap",type='SHRINKWRAP')
-					#mod.target = smd.m
-					#mod.wrap_method = 'NEAREST_VERTEX'
-					
-					vd = vta_ref.to_mesh(bpy.context.scene, True, 'PREVIEW')
-					
-					for i in range(len(vd.vertices)):
+		for shape in shapes:
+			shape_name = smd.shapeNames.get(shape.time)
+			if smd.vta_ref == None:
+				smd.m.shape_key_add(shape_name if shape_name else "Basis")
+				vta_ref = smd.vta_ref = smd.m.copy()
+				vta_ref.name = "VTA vertices"
+				bpy.context.scene.objects.link(vta_ref)
+				vd = vta_ref.data = bpy.data.meshes.new(vta_ref.name)
+			elif making_base_shape:
+				vd.vertices.add(len(vta_cos)/3)
+				vd.vertices.foreach_set("co",vta_cos)
+				del vta_cos
+				
+				#mod = vta_ref.modifiers.new(name="VTA Shrinkwrap",type='SHRINKWRAP')
+				#mod.target = smd.m
+				#mod.wrap_method = 'NEAREST_VERTEX'
+				
+				vd = vta_ref.to_mesh(bpy.context.scene, True, 'PREVIEW')
+				
+				for i in range(len(vd.vertices)):
+					try:
+						co_map[vta_ids[i]] = mesh_cos.index(vd.vertices[i].co)
+					except ValueError:
 						try:
-							co_map[vta_ids[i]] = mesh_cos.index(vd.vertices[i].co)
+							co_map[vta_ids[i]] = mesh_cos_rnd.index(vec_round(vd.vertices[i].co))
 						except ValueError:
-							try:
-								co_map[vta_ids[i]] = mesh_cos_rnd.index(vec_round(vd.vertices[i].co))
-							except ValueError:
-								bad_vta_verts += 1
-					
-					bpy.data.meshes.remove(vd)
-					
-					if bad_vta_verts > 0:
-						err_ratio = bad_vta_verts/len(vta_ids)
-						message = "{} VTA vertices ({}%) were not matched to a mesh vertex! An object has been created to show where the VTA file's vertices are.".format(bad_vta_verts, int(err_ratio * 100))
-						if err_ratio == 1:
-							self.error(message)
-							return
-						else:
-							self.warning(message)
-					else:
-						removeObject(vta_ref)
-					making_base_shape = False
+							bad_vta_verts += 1
 				
-				if not making_base_shape:
-					smd.m.shape_key_add(shape_name if shape_name else values[1])
-					num_shapes += 1
-
-				continue # to the first vertex of the new shape
+				bpy.data.meshes.remove(vd)
+				
+				if bad_vta_verts > 0:
+					err_ratio = bad_vta_verts/len(vta_ids)
+					message = "{} VTA vertices ({}%) were not matched to a mesh vertex! An object has been created to show where the VTA file's vertices are.".format(bad_vta_verts, int(err_ratio * 100))
+					if err_ratio == 1:
+						self.error(message)
+						return
+					else:
+						self.warning(message)
+				else:
+					removeObject(vta_ref)
+				making_base_shape = False
+			
+			if not making_base_shape:
+				smd.m.shape_key_add(shape_name if shape_name else shape.time)
+				num_shapes += 1
 
-			cur_id = int(values[0])
-			vta_co = getUpAxisMat(smd.upAxis) * Vector([ float(values[1]), float(values[2]), float(values[3]) ])
+			for i,cur_id in enumerate(shape.vertices):
+				vta_co = getUpAxisMat(smd.upAxis) * Vector(shape.positions[i*3:i*3+3])
 
-			if making_base_shape:
-				vta_ids.append(cur_id)
-				vta_cos.extend(vta_co)
-			else: # write to the shapekey
-				try:
-					md.shape_keys.key_blocks[-1].data[ co_map[cur_id] ].co = vta_co
-				except KeyError:
-					pass
+				if making_base_shape:
+					vta_ids.append(cur_id)
+					vta_cos.extend(vta_co)
+				else: # write to the shapekey
+					try:
+						md.shape_keys.key_blocks[-1].data[ co_map[cur_id] ].co = vta_co
+					except KeyError:
+						pass
 
 		print("- Imported",num_shapes,"flex shapes")
 
@@ -954,47 +793,7 @@ class SmdImporter(bpy.types.Operator, Logger):
 		file = open(filepath, 'r')
 		in_bodygroup = in_lod = False
 		lod = 0
-		for line_str in file:
-			line = self.parseQuoteBlockedLine(line_str)
-			if len(line) == 0:
-				continue
-			#print(line)
-
-			# handle individual words (insert QC variable values, change slashes)
-			i = 0
-			for word in line:
-				for var in qc.vars.keys():
-					kw = "${}$".format(var)
-					pos = word.lower().find(kw)
-					if pos != -1:
-						word = word.replace(word[pos:pos+len(kw)], qc.vars[var])			
-				line[i] = word.replace("/","\\") # studiomdl is Windows-only
-				i += 1
-			
-			# Skip macros
-			if line[0] == "$definemacro":
-				self.warning("Skipping macro in QC {}".format(filename))
-				while line[-1] == "\\\\":
-					line = self.parseQuoteBlockedLine( file.readline())
-
-			# register new QC variable
-			if line[0] == "$definevariable":
-				qc.vars[line[1]] = line[2].lower()
-				continue
-
-			# dir changes
-			if line[0] == "$pushd":
-				if line[1][-1] != "\\":
-					line[1] += "\\"
-				qc.dir_stack.append(line[1])
-				continue
-			if line[0] == "$popd":
-				try:
-					qc.dir_stack.pop()
-				except IndexError:
-					pass # invalid QC, but whatever
-				continue
-
+		for line in self.iterQCLines(file,filename):
 			# up axis
 			if line[0] == "$upaxis":
 				qc.upAxis = bpy.context.scene.smd_up_axis = line[1].upper()
@@ -1005,16 +804,12 @@ class SmdImporter(bpy.types.Operator, Logger):
 			if line[0] == "$definebone":
 				pass # TODO
 
-			def loadSMD(word_index,ext,type, append=True,layer=0,in_file_recursion = False):
-				path = os.path.join( qc.cd(), appendExt(line[word_index],ext) )
+			def loadSMD(word_index,ext,type, append=True,layer=0):
+				path = self.getQCFilePath(line[word_index],ext)
 				
 				if not os.path.exists(path):
-					if not in_file_recursion:
-						if loadSMD(word_index,"dmx",type,append,layer,True):
-							return True
-						else:
-							self.error("Could not open file",path)
-							return False
+					self.error("Could not open file",path)
+					return False
 				if not path in qc.imported_smds: # FIXME: an SMD loaded once relatively and once absolutely will still pass this test
 					qc.imported_smds.append(path)
 					if path.endswith("dmx"):
@@ -1052,30 +847,8 @@ class SmdImporter(bpy.types.Operator, Logger):
 
 			# skeletal animations
 			if doAnim and line[0] in ["$sequence","$animation"]:
-				# there is no easy way to determine whether a SMD is being defined here or elsewhere, or even precisely where it is being defined
-				num_words_to_skip = 0
-				for i in range(2, len(line)):
-					if num_words_to_skip:
-						num_words_to_skip -= 1
-						continue
-					if line[i] == "{":
-						break
-					if line[i] in ["hidden","autolay","realtime","snap","spline","xfade","delta","predelta"]:
-						continue
-					if line[i] in ["fadein","fadeout","addlayer","blendwidth","node"]:
-						num_words_to_skip = 1
-						continue
-					if line[i] in ["activity","transision","rtransition"]:
-						num_words_to_skip = 2
-						continue
-					if line[i] in ["blend"]:
-						num_words_to_skip = 3
-						continue
-					if line[i] in ["blendlayer"]:
-						num_words_to_skip = 5
-						continue
-					# there are many more keywords, but they can only appear *after* an SMD is referenced
-				
+				i = self.findSequenceSMD(line)
+				if i != None:
 					if not qc.a: qc.a = self.findArmature()
 				
 					if line[i].lower() not in qc.animation_names:
@@ -1089,7 +862,6 @@ class SmdImporter(bpy.types.Operator, Logger):
 								if 'fps' in dir(qc.a.animation_data.action):
 									qc.a.animation_data.action.fps = float(line[i+1])
 							i += 1
-					break
 				continue
 
 			# flex animation
@@ -1149,13 +921,7 @@ class SmdImporter(bpy.types.Operator, Logger):
 
 			# QC inclusion
 			if line[0] == "$include":
-				path = os.path.join(qc.root_filedir,line[1]) # special case: ignores dir stack
-
-				if not path.endswith(".qc") and not path.endswith(".qci"):
-					if os.path.exists(appendExt(path,".qci")):
-						path = appendExt(path,".qci")
-					elif os.path.exists(appendExt(path,".qc")):
-						path = appendExt(path,".qc")
+				path = self.getQCIncludePath(line[1])
 				try:
 					self.readQC(path,False, doAnim, makeCamera, rotMode)
 				except IOError:
@@ -1177,6 +943,100 @@ class SmdImporter(bpy.types.Operator, Logger):
 			printTimeMessage(qc.startTime,filename,"import","QC")
 		return qc.numSMDs
 
+	# Yields the lines of a QC as lists of words, after substituting variables. Macros, variables and directory changes are handled here.
+	def iterQCLines(self, file, filename):
+		qc = self.qc
+		for line_str in file:
+			line = self.parseQuoteBlockedLine(line_str)
+			if len(line) == 0:
+				continue
+			#print(line)
+
+			# handle individual words (insert QC variable values, change slashes)
+			i = 0
+			for word in line:
+				for var in qc.vars.keys():
+					kw = "${}$".format(var)
+					pos = word.lower().find(kw)
+					if pos != -1:
+						word = word.replace(word[pos:pos+len(kw)], qc.vars[var])			
+				line[i] = word.replace("/","\\") # studiomdl is Windows-only
+				i += 1
+			
+			# Skip macros
+			if line[0] == "$definemacro":
+				self.warning("Skipping macro in QC {}".format(filename))
+				while line[-1] == "\\\\":
+					line = self.parseQuoteBlockedLine( file.readline())
+				qc.skipped_macro = True
+				continue
+
+			# register new QC variable
+			if line[0] == "$definevariable":
+				qc.vars[line[1]] = line[2].lower()
+				continue
+
+			# dir changes
+			if line[0] == "$pushd":
+				if line[1][-1] != "\\":
+					line[1] += "\\"
+				qc.dir_stack.append(line[1])
+				continue
+			if line[0] == "$popd":
+				try:
+					qc.dir_stack.pop()
+				except IndexError:
+					pass # invalid QC, but whatever
+				continue
+			
+			yield line
+
+	# Resolves a model file named in a QC. Falls back to DMX if there is no file with the given extension.
+	def getQCFilePath(self, word, ext):
+		path = os.path.join( self.qc.cd(), appendExt(word,ext) )
+		if not os.path.exists(path):
+			dmx_path = os.path.join( self.qc.cd(), appendExt(word,"dmx") )
+			if os.path.exists(dmx_path):
+				return dmx_path
+		return path
+
+	def getQCIncludePath(self, word):
+		path = os.path.join(self.qc.root_filedir,word) # special case: ignores dir stack
+
+		if not path.endswith(".qc") and not path.endswith(".qci"):
+			if os.path.exists(appendExt(path,"qci")):
+				path = appendExt(path,"qci")
+			elif os.path.exists(appendExt(path,"qc")):
+				path = appendExt(path,"qc")
+		return path
+
+	# Returns the index of the SMD in a $sequence or $animation line, or None if the animation data is defined elsewhere.
+	def findSequenceSMD(self, line):
+		# there is no easy way to determine whether a SMD is being defined here or elsewhere, or even precisely where it is being defined
+		num_words_to_skip = 0
+		for i in range(2, len(line)):
+			if num_words_to_skip:
+				num_words_to_skip -= 1
+				continue
+			if line[i] == "{":
+				return None
+			if line[i] in ["hidden","autolay","realtime","snap","spline","xfade","delta","predelta"]:
+				continue
+			if line[i] in ["fadein","fadeout","addlayer","blendwidth","node"]:
+				num_words_to_skip = 1
+				continue
+			if line[i] in ["activity","transision","rtransition"]:
+				num_words_to_skip = 2
+				continue
+			if line[i] in ["blend"]:
+				num_words_to_skip = 3
+				continue
+			if line[i] in ["blendlayer"]:
+				num_words_to_skip = 5
+				continue
+			# there are many more keywords, but they can only appear *after* an SMD is referenced
+			return i
+
 	def initSMD(self, filepath,smd_type,append,upAxis,rotMode,target_layer):
 		smd = self.smd = SmdInfo()
 		smd.jobName = os.path.splitext(os.path.basename(filepath))[0]
@@ -1202,7 +1062,7 @@ class SmdImporter(bpy.types.Operator, Logger):
 		smd = self.initSMD(filepath,smd_type,append,upAxis,rotMode,target_layer)
 
 		try:
-			smd.file = file = open(filepath, 'r')
+			file = open(filepath, 'r')
 		except IOError as err: # TODO: work out why errors are swallowed if I don't do this!
 			message = "Could not open SMD file \"{}\": {}".format(smd.jobName,err)
 			self.error(message)
@@ -1214,24 +1074,27 @@ class SmdImporter(bpy.types.Operator, Logger):
 			bpy.context.scene.name = smd.jobName
 
 		print("\nSMD IMPORTER: now working on",smd.jobName)
+
+		# The whole file is parsed in one pass, so nothing needs to be read twice
+		try:
+			data = smd_format.load(in_file=file)
+		except ValueError as err:
+			self.error("Could not read SMD file \"{}\": {}".format(smd.jobName,err))
+			return 0
+		finally:
+			file.close()
 		
-		while True:
-			header = self.parseQuoteBlockedLine(file.readline())
-			if len(header): break
-		
-		if header != ["version" ,"1"]:
+		if data.header != ["version" ,"1"]:
 			self.warning ("Unrecognised/invalid SMD file. Import will proceed, but may fail!")
 
 		if smd.jobType == None:
-			self.scanSMD() # What are we dealing with?
+			self.scanSMD(data.blocks) # What are we dealing with?
 
-		for line in file:
-			if line == "nodes\n": self.readNodes()
-			if line == "skeleton\n": self.readFrames()
-			if line == "triangles\n": self.readPolys()
-			if line == "vertexanimation\n": self.readShapes()
-
-		file.close()
+		for block in data.blocks:
+			if block == "nodes": self.readNodes(data.nodes)
+			if block == "skeleton": self.readFrames(data.frames)
+			if block == "triangles": self.readPolys(data.triangles)
+			if block == "vertexanimation": self.readShapes(data.shapes)
 		'''
 		if smd.m and smd.upAxisMat and smd.upAxisMat != 1:
 			smd.m.rotation_euler = smd.upAxisMat.to_euler()
@@ -1565,3 +1428,107 @@ class SmdImporter(bpy.types.Operator, Logger):
 		
 		bench("DMX imported in")
 		return 1
+
+class QcDependencyReader(Logger):
+	'''Lists the files that a QC consumes, using SmdImporter's QC directive handling. Nothing is imported.'''
+	qc = None
+	parseQuoteBlockedLine = SmdImporter.parseQuoteBlockedLine
+	iterQCLines = SmdImporter.iterQCLines
+	getQCFilePath = SmdImporter.getQCFilePath
+	getQCIncludePath = SmdImporter.getQCIncludePath
+	findSequenceSMD = SmdImporter.findSequenceSMD
+
+	# Returns the paths of the QC, its $includes and every model file they reference. Paths which don't exist are included too.
+	# If something couldn't be resolved, e.g. a macro or a $sequence block with no recognisable SMD, self.complete is False.
+	def read(self, filepath):
+		self.qc = QcInfo()
+		self.qc.root_filedir = os.path.dirname(filepath)
+		self.qc.animation_names = []
+		self.paths = set()
+		self.complete = True
+		self.readQC(filepath)
+		if self.qc.skipped_macro: # the lines a macro generates aren't read
+			self.complete = False
+		return self.paths
+
+	# A word at the top level of a $sequence or $animation block is an SMD, an $animation or an option. Returns False if it isn't clear which.
+	def addSequenceFile(self, word):
+		if word.lower() in self.qc.animation_names:
+			return True
+		path = self.getQCFilePath(word,"smd")
+		if os.path.exists(path) or os.path.splitext(word)[1].lower() in [".smd",".dmx"]:
+			self.paths.add(path)
+			return True
+		return False
+
+	def readQC(self, filepath):
+		self.paths.add(filepath)
+		try:
+			file = open(filepath, 'r')
+		except IOError:
+			return
+
+		in_bodygroup = in_lod = in_sequence = False
+		sequence_depth = 0
+		sequence_resolved = True
+		for line in self.iterQCLines(file,os.path.basename(filepath)):
+			def addFile(word_index,ext):
+				if word_index < len(line):
+					self.paths.add(self.getQCFilePath(line[word_index],ext))
+
+			if in_sequence:
+				if sequence_depth == 0 and line[0] != "{": # no SMD on the $sequence line, and no block after it either
+					in_sequence = False
+					self.complete = False
+				else:
+					if sequence_depth == 1 and not sequence_resolved and line[0] not in ["{","}"]:
+						sequence_resolved = self.addSequenceFile(line[0])
+					sequence_depth += line.count("{") - line.count("}")
+					if sequence_depth <= 0:
+						in_sequence = False
+						if not sequence_resolved:
+							self.complete = False
+					continue
+
+			if line[0] in ["$body","$model"]:
+				addFile(2,"smd")
+			elif line[0] == "$lod":
+				in_lod = True
+			elif in_lod and line[0] == "replacemodel":
+				addFile(2,"smd")
+			elif in_lod and "}" in line:
+				in_lod = False
+			elif line[0] == "$bodygroup":
+				in_bodygroup = True
+			elif in_bodygroup and line[0] == "studio":
+				addFile(1,"smd")
+			elif in_bodygroup and "}" in line:
+				in_bodygroup = False
+			elif line[0] in ["$sequence","$animation"]:
+				i = self.findSequenceSMD(line)
+				if i != None and line[i].lower() not in self.qc.animation_names:
+					addFile(i,"smd")
+				sequence_resolved = i != None
+				if "{" in line:
+					body = line[line.index("{")+1:]
+					if not sequence_resolved and len(body) and body[0] != "}":
+						sequence_resolved = self.addSequenceFile(body[0])
+					sequence_depth = line.count("{") - line.count("}")
+					in_sequence = True
+					if sequence_depth <= 0: # the whole block is on this line
+						in_sequence = False
+						if not sequence_resolved:
+							self.complete = False
+				elif not sequence_resolved: # the block opens on the next line
+					sequence_depth = 0
+					in_sequence = True
+				if line[0] == "$animation" and len(line) > 1 and line[1].lower() not in self.qc.animation_names:
+					self.qc.animation_names.append(line[1].lower())
+			elif line[0] == "flexfile":
+				addFile(1,"vta")
+			elif line[0] in ["$collisionmodel","$collisionjoints"]:
+				addFile(1,"smd")
+			elif line[0] == "$include":
+				self.readQC(self.getQCIncludePath(line[1]))
+
+		file.close()
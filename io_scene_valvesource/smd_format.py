@@ -0,0 +1,289 @@
+#  Copyright (c) 2013 Tom Edwards contact@steamreview.org
+#
+# ##### BEGIN GPL LICENSE BLOCK #####
+#
+#  This program is free software; you can redistribute it and/or
+#  modify it under the terms of the GNU General Public License
+#  as published by the Free Software Foundation; either version 2
+#  of the License, or (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software Foundation,
+#  Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301, USA.
+#
+# ##### END GPL LICENSE BLOCK #####
+
+# Reads SMD and VTA files into flat arrays. There is no Blender dependency here; the importer builds Blender data from the result.
+# To time the parser on its own:
+#
+#	python smd_format.py model.smd
+
+import array, re, sys, time
+
+class Node:
+	__slots__ = ("id","name","parent")
+
+	def __init__(self,id,name,parent):
+		self.id = id
+		self.name = name
+		self.parent = parent # -1 for root bones
+
+	def __repr__(self):
+		return "<Node {} \"{}\" parent {}>".format(self.id,self.name,self.parent)
+
+class Frame:
+	'''One "time" of a skeleton block. transforms holds six values per entry in bones: position XYZ, then Euler rotation XYZ.'''
+	__slots__ = ("time","name","bones","transforms")
+
+	def __init__(self,time,name=None):
+		self.time = time # a string, since VTAs key shape names with it
+		self.name = name # VTAs name each shape in a comment on its "time" line
+		self.bones = array.array('i')
+		self.transforms = array.array('f')
+
+class Triangles:
+	'''A triangles block. Every corner has its own position, normal and UV, so corner N of triangle T is at index T*3+N.
+	The weight links of corner C are link_bones[link_starts[C]:link_starts[C+1]] and the same slice of link_weights.'''
+
+	def __init__(self):
+		self.materials = [] # names in order of first use
+		self.material_indices = array.array('i') # one per triangle
+		self.positions = array.array('f') # three per corner
+		self.normals = array.array('f') # three per corner
+		self.uvs = array.array('f') # two per corner
+		self.link_starts = array.array('i',[0])
+		self.link_bones = array.array('i')
+		self.link_weights = array.array('f')
+
+	def __len__(self):
+		return len(self.material_indices)
+
+class Shape:
+	'''One "time" of a vertexanimation block: the positions of the VTA vertices which it moves.'''
+	__slots__ = ("time","vertices","positions")
+
+	def __init__(self,time):
+		self.time = time
+		self.vertices = array.array('i')
+		self.positions = array.array('f') # three per entry in vertices
+
+class Smd:
+	def __init__(self):
+		self.header = [] # should be ["version","1"]
+		self.blocks = [] # block names in the order they first appear
+		self.nodes = []
+		self.frames = []
+		self.triangles = Triangles()
+		self.shapes = []
+
+class _Lines:
+	'''Iterates over a text file, counting lines for error messages.'''
+	def __init__(self,file):
+		self.file = iter(file)
+		self.number = 0
+	def __iter__(self):
+		return self
+	def __next__(self):
+		line = next(self.file)
+		self.number += 1
+		return line
+
+def _is_end(line):
+	line = line.rstrip('\n')
+	return line == "end" or line == ""
+
+def _is_comment(line):
+	return line.startswith("//")
+
+def _split_comment(line):
+	'''Returns the line without any trailing comment, and the text of that comment or None.'''
+	for i,char in enumerate(line):
+		if char in "#;" or line.startswith("//",i):
+			return line[:i], line[i + (2 if char == "/" else 1):].strip()
+	return line, None
+
+_node_pattern = re.compile(r'\s*(-?\d+)\s+(?:"([^"]*)"|(\S+))\s+(-?\d+)')
+
+def _read_nodes(smd,lines):
+	for line in lines:
+		if _is_end(line): break
+		if _is_comment(line): continue
+		match = _node_pattern.match(line)
+		if not match:
+			raise ValueError("expected a bone ID, name and parent ID")
+		name = match.group(2) if match.group(2) != None else match.group(3)
+		smd.nodes.append(Node(int(match.group(1)),name,int(match.group(4))))
+
+def _read_frames(smd,lines):
+	frame = None
+	for line in lines:
+		if _is_end(line): break
+		if _is_comment(line): continue
+		values = line.split()
+
+		if values[0] == "time":
+			text, name = _split_comment(line)
+			frame = Frame(text.split()[1],name)
+			smd.frames.append(frame)
+			continue
+
+		if not frame:
+			raise ValueError("bone transform found before \"time\"")
+		if len(values) < 7:
+			raise ValueError("expected a bone ID, position and rotation")
+		frame.bones.append(int(values[0]))
+		frame.transforms.extend([float(value) for value in values[1:7]])
+
+def _read_triangles(smd,lines):
+	tris = smd.triangles
+	material_indices = { name:i for i,name in enumerate(tris.materials) }
+	for line in lines:
+		material = line.rstrip("\n")
+		if material and _is_end(material): # normally a blank line means a break, but Milkshape can export SMDs with zero-length material names...
+			break
+		if _is_comment(material):
+			continue
+
+		corners = []
+		for line in lines:
+			if _is_end(line): break
+			if _is_comment(line): continue
+			corners.append(line.split())
+			if len(corners) == 3: break
+		if len(corners) < 3: # the block ended mid-triangle
+			break
+
+		index = material_indices.get(material)
+		if index == None:
+			index = material_indices[material] = len(tris.materials)
+			tris.materials.append(material)
+		tris.material_indices.append(index)
+
+		for values in corners:
+			if len(values) < 9:
+				raise ValueError("expected a parent bone ID, position, normal and UV")
+			tris.positions.extend([float(values[1]),float(values[2]),float(values[3])])
+			tris.normals.extend([float(values[4]),float(values[5]),float(values[6])])
+			tris.uvs.extend([float(values[7]),float(values[8])])
+
+			if len(values) > 10 and values[9] != "0": # got weight links?
+				for i in range(10, 10 + (int(values[9]) * 2), 2): # each link is *two* values
+					tris.link_bones.append(int(values[i]))
+					tris.link_weights.append(float(values[i+1]))
+			else: # fall back on the deprecated parent bone value at the start of the line
+				tris.link_bones.append(int(values[0]))
+				tris.link_weights.append(1.0)
+			tris.link_starts.append(len(tris.link_bones))
+
+def _read_shapes(smd,lines):
+	shape = None
+	for line in lines:
+		if _is_end(line): break
+		if _is_comment(line): continue
+		values = line.split()
+
+		if values[0] == "time":
+			shape = Shape(values[1])
+			smd.shapes.append(shape)
+			continue
+
+		if not shape:
+			raise ValueError("vertex found before \"time\"")
+		shape.vertices.append(int(values[0]))
+		shape.positions.extend([float(values[1]),float(values[2]),float(values[3])])
+
+def gather(values,indices,width):
+	'''Returns an array holding the width values at values[i*width] for each i in indices.'''
+	out = array.array(values.typecode)
+	for i in indices:
+		out.extend(values[i*width:i*width+width])
+	return out
+
+def weld(tris,normals=False,uvs=False):
+	'''Merges triangle corners with the same position (and, optionally, the same normal and/or UV) into shared vertices. Triangles whose
+	corners merge together are dropped. A triangle with the same vertices as an earlier one, such as the back of a double-sided face, is
+	given its own set of vertices shared only with other such triangles; otherwise Blender would discard it.
+
+	Returns three arrays: the corner which each shared vertex was taken from, the vertex used by each corner of each kept triangle, and
+	the indices of the kept triangles.'''
+	keys = list(zip(tris.positions[0::3],tris.positions[1::3],tris.positions[2::3]))
+	if normals:
+		keys = list(zip(keys,zip(tris.normals[0::3],tris.normals[1::3],tris.normals[2::3])))
+	if uvs:
+		keys = list(zip(keys,zip(tris.uvs[0::2],tris.uvs[1::2])))
+
+	vertices = array.array('i')
+	loops = array.array('i')
+	faces = array.array('i')
+	layers = [] # a vertex map and a set of faces for each layer of coincident triangles
+
+	for t in range(len(tris)):
+		corners = range(t*3,t*3+3)
+		key_a,key_b,key_c = [keys[c] for c in corners]
+		if key_a == key_b or key_b == key_c or key_a == key_c:
+			continue
+
+		for vertex_map,layer_faces in layers:
+			face = [vertex_map.get(keys[c]) for c in corners]
+			if None in face or tuple(sorted(face)) not in layer_faces:
+				break
+		else:
+			vertex_map,layer_faces = {},set()
+			layers.append((vertex_map,layer_faces))
+			face = [None] * 3
+
+		for i,c in enumerate(corners):
+			if face[i] == None:
+				face[i] = vertex_map[keys[c]] = len(vertices)
+				vertices.append(c)
+		layer_faces.add(tuple(sorted(face)))
+		loops.extend(face)
+		faces.append(t)
+
+	return vertices,loops,faces
+
+_block_readers = {
+	"nodes":_read_nodes,
+	"skeleton":_read_frames,
+	"triangles":_read_triangles,
+	"vertexanimation":_read_shapes,
+}
+
+def load(path = None, in_file = None):
+	'''Reads an SMD or VTA from a path or text file object. Raises ValueError, with the line number, if the file is malformed.'''
+	if bool(path) == bool(in_file):
+		raise ValueError("A path string OR a file object must be provided")
+	file = in_file if in_file else open(path,'r')
+
+	try:
+		smd = Smd()
+		lines = _Lines(file)
+		for line in lines:
+			smd.header = _split_comment(line)[0].split()
+			if smd.header: break
+
+		for line in lines:
+			block = line.strip()
+			reader = _block_readers.get(block)
+			if reader:
+				reader(smd,lines)
+				if block not in smd.blocks:
+					smd.blocks.append(block)
+		return smd
+	except (ValueError,IndexError) as err:
+		raise ValueError("Line {}: {}".format(lines.number,err)) from err
+	finally:
+		if not in_file:
+			file.close()
+
+if __name__ == "__main__":
+	for path in sys.argv[1:]:
+		start = time.perf_counter()
+		smd = load(path)
+		elapsed = time.perf_counter() - start
+		print("{}: {:.3f}s. {} nodes, {} frames, {} triangles, {} shapes".format(path, elapsed, len(smd.nodes), len(smd.frames), len(smd.triangles), len(smd.shapes)))
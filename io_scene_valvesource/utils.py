@@ -357,6 +357,7 @@ class QcInfo:
 	numSMDs = 0
 	makeCamera = False
 	in_block_comment = False
+	skipped_macro = False
 	jobName = ""
 	root_filedir = ""
 	
@@ -382,8 +383,20 @@ class Cache:
 	
 	scene_updated = False
 	action_filter = ""
+	
+	export_hashes = {} # path: (digest,mtime) of each file the exporter last wrote
+	compiled_qcs = {} # path: (compiler settings, { input path: fileSignature() }) of each QC at its last successful compile
+	export_thread = None # the thread of the last background export or compile; it is running if is_alive()
 p_cache = Cache() # package cached data
 
+def fileSignature(path):
+	'''Returns the modification time and size of a file, or None if it doesn't exist.'''
+	try:
+		stat = os.stat(path)
+		return (stat.st_mtime,stat.st_size)
+	except OSError:
+		return None
+
 class SMD_OT_LaunchHLMV(bpy.types.Operator):
 	'''Launches Half-Life Model Viewer'''
 	bl_idname = "smd.launch_hlmv"